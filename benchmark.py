@@ -0,0 +1,489 @@
+from aiohttp import web
+from eth_abi import encode, decode
+from eth_account import Account
+from eth_account.typed_transactions import TypedTransaction
+from eth_utils import keccak
+from hexbytes import HexBytes
+from contextlib import redirect_stdout
+import argparse
+import asyncio
+import random
+import time
+import sys
+import os
+import io
+import json
+import tempfile
+import rlp
+
+# Offline benchmark for SatsumaBot. A local stand-in JSON-RPC node implements the methods the bot
+# uses, with configurable latency, block time and error injection, and every scenario is timed and
+# counted against it. Results are written as JSON so two versions can be compared with --baseline.
+
+RESULTS_FILE = "benchmark_results.json"
+CHAIN_ID = 5115
+MULTICALL3 = "0xca11bde05977b3631167028862be2a173976ca11"
+TOKEN_BALANCE = 10 ** 24
+NATIVE_BALANCE = 10 ** 21
+# Simulated swaps return this share of the input, in basis points; every pool quotes a matching
+# 1% fee at price 1 with deep liquidity, so local quotes agree with the simulated output
+SWAP_RETURN_BPS = 9900
+POOL_FEE = 10000
+POOL_LIQUIDITY = 10 ** 30
+FACTORY = "0x" + "fa" * 20
+LOOP_MONITOR_INTERVAL = 0.005
+# Methods whose failure the bot cannot retry transparently; error injection leaves them alone
+NO_INJECT_METHODS = {"eth_sendRawTransaction", "eth_chainId"}
+
+
+def selector(signature):
+    return keccak(text=signature)[:4].hex()
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+APPROVAL_TOPIC = "0x" + keccak(text="Approval(address,address,uint256)").hex()
+SELECTORS = {
+    "aggregate3": selector("aggregate3((address,bool,bytes)[])"),
+    "getEthBalance": selector("getEthBalance(address)"),
+    "balanceOf": selector("balanceOf(address)"),
+    "decimals": selector("decimals()"),
+    "symbol": selector("symbol()"),
+    "allowance": selector("allowance(address,address)"),
+    "approve": selector("approve(address,uint256)"),
+    "locked": selector("locked(address)"),
+    "exactInputSingle": selector("exactInputSingle((address,address,address,address,uint256,uint256,uint256,uint160))"),
+    "multicall": selector("multicall(bytes[])"),
+    "getBlockNumber": selector("getBlockNumber()"),
+    "factory": selector("factory()"),
+    "poolByPair": selector("poolByPair(address,address)"),
+    "globalState": selector("globalState()"),
+    "liquidity": selector("liquidity()"),
+}
+
+
+class FakeNode:
+    # An in-memory chain: accepts signed transactions, mines them on a timer and answers the
+    # read methods the bot issues. Every JSON-RPC request is counted per method.
+    def __init__(self, latency=0.0, block_time=0.5, error_rate=0.0, multicall=True, block_receipts=True):
+        self.latency = latency
+        self.block_time = block_time
+        self.error_rate = error_rate
+        self.multicall = multicall
+        self.block_receipts = block_receipts
+        self.block = 100
+        self.blocks = {100: []}
+        self.nonces = {}
+        self.mempool = []
+        self.txs = {}
+        self.receipts = {}
+        self.allowances = {}
+        self.logs = []
+        self.calls = {}
+        self.http_requests = 0
+        self.runner = None
+        self.miner_task = None
+        self.url = None
+
+    def snapshot(self):
+        return dict(self.calls), self.http_requests
+
+    def decode_raw(self, raw):
+        data = HexBytes(raw)
+        sender = Account.recover_transaction(data).lower()
+        if data[0] < 0x7f:
+            fields = TypedTransaction.from_bytes(data).as_dict()
+            tx = {
+                "nonce": fields["nonce"], "to": fields["to"], "data": HexBytes(fields["data"]).hex(),
+                "value": fields["value"], "gas": fields["gas"], "price": fields.get("maxFeePerGas", fields.get("gasPrice"))
+            }
+        else:
+            fields = rlp.decode(bytes(data))
+            tx = {
+                "nonce": int.from_bytes(fields[0], "big"), "price": int.from_bytes(fields[1], "big"),
+                "gas": int.from_bytes(fields[2], "big"), "to": fields[3], "value": int.from_bytes(fields[4], "big"),
+                "data": fields[5].hex()
+            }
+        tx["to"] = "0x" + HexBytes(tx["to"]).hex().removeprefix("0x").lower() if tx["to"] else None
+        tx["data"] = tx["data"].removeprefix("0x")
+        tx["from"] = sender
+        tx["hash"] = "0x" + keccak(bytes(data)).hex()
+        return tx
+
+    def call(self, to, data):
+        to = to.lower()
+        data = data.removeprefix("0x")
+        sig, args = data[:8], bytes.fromhex(data[8:])
+        if to == MULTICALL3 and self.multicall:
+            if sig == SELECTORS["aggregate3"]:
+                (calls,) = decode(["(address,bool,bytes)[]"], args)
+                results = []
+                for target, _, calldata in calls:
+                    try:
+                        results.append((True, self.call(target, calldata.hex())))
+                    except Exception:
+                        results.append((False, b""))
+                return encode(["(bool,bytes)[]"], [results])
+            if sig == SELECTORS["getEthBalance"]:
+                return encode(["uint256"], [NATIVE_BALANCE])
+            if sig == SELECTORS["getBlockNumber"]:
+                return encode(["uint256"], [self.block])
+        if sig == SELECTORS["balanceOf"]:
+            return encode(["uint256"], [TOKEN_BALANCE])
+        if sig == SELECTORS["decimals"]:
+            return encode(["uint8"], [18])
+        if sig == SELECTORS["symbol"]:
+            return encode(["string"], ["TKN"])
+        if sig == SELECTORS["allowance"]:
+            owner, spender = decode(["address", "address"], args)
+            return encode(["uint256"], [self.allowances.get((to, owner.lower(), spender.lower()), 0)])
+        if sig == SELECTORS["locked"]:
+            return encode(["uint256", "uint256"], [10 ** 18, 0])
+        if sig == SELECTORS["exactInputSingle"]:
+            params = decode(["(address,address,address,address,uint256,uint256,uint256,uint160)"], args)[0]
+            return encode(["uint256"], [params[5] * SWAP_RETURN_BPS // 10000])
+        if sig == SELECTORS["factory"]:
+            return encode(["address"], [FACTORY])
+        if sig == SELECTORS["poolByPair"] and to == FACTORY:
+            return encode(["address"], ["0x" + keccak(args)[:20].hex()])
+        if sig == SELECTORS["globalState"]:
+            return encode(["uint160", "int24", "uint16"], [2 ** 96, 0, POOL_FEE])
+        if sig == SELECTORS["liquidity"]:
+            return encode(["uint128"], [POOL_LIQUIDITY])
+        if sig == SELECTORS["multicall"]:
+            (items,) = decode(["bytes[]"], args)
+            return encode(["bytes[]"], [[self.call(to, item.hex()) for item in items]])
+        return b""
+
+    def block_hash(self, number):
+        return "0x" + keccak(str(number).encode()).hex()
+
+    def mine(self):
+        self.block += 1
+        included = []
+        for tx in sorted(self.mempool, key=lambda t: (t["from"], t["nonce"])):
+            logs = []
+            if tx["data"].startswith(SELECTORS["approve"]):
+                spender, amount = decode(["address", "uint256"], bytes.fromhex(tx["data"][8:]))
+                self.allowances[(tx["to"], tx["from"], spender.lower())] = amount
+                logs.append({
+                    "address": tx["to"], "data": "0x" + amount.to_bytes(32, "big").hex(),
+                    "topics": [APPROVAL_TOPIC, "0x" + "0" * 24 + tx["from"][2:], "0x" + "0" * 24 + spender.lower()[2:]]
+                })
+            gas_used = min(tx["gas"], random.randint(60000, 130000))
+            index = hex(len(included))
+            self.receipts[tx["hash"]] = {
+                "transactionHash": tx["hash"], "transactionIndex": index, "blockNumber": hex(self.block),
+                "blockHash": self.block_hash(self.block), "from": tx["from"], "to": tx["to"], "status": "0x1",
+                "gasUsed": hex(gas_used), "cumulativeGasUsed": hex(gas_used), "effectiveGasPrice": hex(tx["price"]),
+                "contractAddress": None, "logsBloom": "0x" + "0" * 512, "type": "0x2",
+                "logs": [dict(entry, blockNumber=hex(self.block), blockHash=self.block_hash(self.block), transactionHash=tx["hash"],
+                              transactionIndex=index, logIndex=hex(i), removed=False) for i, entry in enumerate(logs)]
+            }
+            self.logs.extend(self.receipts[tx["hash"]]["logs"])
+            included.append(tx["hash"])
+        self.mempool = []
+        self.blocks[self.block] = included
+
+    async def miner(self):
+        while True:
+            await asyncio.sleep(self.block_time)
+            self.mine()
+
+    def handle(self, method, params):
+        if method == "eth_chainId":
+            return hex(CHAIN_ID)
+        if method == "net_version":
+            return str(CHAIN_ID)
+        if method == "web3_clientVersion":
+            return "FakeNode/1.0"
+        if method == "eth_blockNumber":
+            return hex(self.block)
+        if method == "eth_getBalance":
+            return hex(NATIVE_BALANCE)
+        if method == "eth_getCode":
+            return "0x6080" if params[0].lower() != MULTICALL3 or self.multicall else "0x"
+        if method == "eth_call":
+            call = params[0]
+            return "0x" + self.call(call["to"], call.get("data") or call.get("input") or "0x").hex()
+        if method == "eth_estimateGas":
+            return hex(90000)
+        if method == "eth_gasPrice":
+            return hex(10 ** 9)
+        if method == "eth_maxPriorityFeePerGas":
+            return hex(10 ** 8)
+        if method == "eth_feeHistory":
+            count = int(params[0], 16) if isinstance(params[0], str) else params[0]
+            return {
+                "oldestBlock": hex(self.block - count + 1), "baseFeePerGas": [hex(10 ** 9)] * (count + 1),
+                "gasUsedRatio": [0.5] * count, "reward": [[hex(10 ** 7 * (i + 1)) for i in range(len(params[2]))] for _ in range(count)]
+            }
+        if method == "eth_getTransactionCount":
+            address = params[0].lower()
+            nonce = self.nonces.get(address, 0)
+            if params[1] == "pending":
+                return hex(nonce)
+            return hex(nonce - sum(1 for tx in self.mempool if tx["from"] == address))
+        if method == "eth_sendRawTransaction":
+            tx = self.decode_raw(params[0])
+            if tx["hash"] in self.txs:
+                raise Exception("already known")
+            expected = self.nonces.get(tx["from"], 0)
+            if tx["nonce"] < expected:
+                raise Exception("nonce too low")
+            self.nonces[tx["from"]] = max(expected, tx["nonce"] + 1)
+            self.txs[tx["hash"]] = tx
+            self.mempool.append(tx)
+            return tx["hash"]
+        if method == "eth_getTransactionReceipt":
+            return self.receipts.get(params[0])
+        if method == "eth_getTransactionByHash":
+            tx = self.txs.get(params[0])
+            if not tx:
+                return None
+            return {"hash": tx["hash"], "nonce": hex(tx["nonce"]), "from": tx["from"], "to": tx["to"], "blockNumber": self.receipts.get(tx["hash"], {}).get("blockNumber")}
+        if method == "eth_getBlockByNumber":
+            number = self.block if params[0] in ("latest", "pending") else int(params[0], 16)
+            if number > self.block:
+                return None
+            return {
+                "number": hex(number), "hash": self.block_hash(number), "parentHash": self.block_hash(number - 1),
+                "timestamp": hex(int(time.time())), "baseFeePerGas": hex(10 ** 9), "gasLimit": hex(30000000),
+                "gasUsed": hex(0), "transactions": self.blocks.get(number, [])
+            }
+        if method == "eth_getBlockReceipts" and self.block_receipts:
+            return [self.receipts[tx_hash] for tx_hash in self.blocks.get(int(params[0], 16), [])]
+        if method == "eth_getLogs":
+            query = params[0]
+            from_block = int(query.get("fromBlock", "0x0"), 16)
+            to_block = int(query.get("toBlock", hex(self.block)), 16)
+            return [entry for entry in self.logs if from_block <= int(entry["blockNumber"], 16) <= to_block]
+        raise KeyError(method)
+
+    def respond(self, request):
+        method = request.get("method")
+        self.calls[method] = self.calls.get(method, 0) + 1
+        try:
+            if self.error_rate and method not in NO_INJECT_METHODS and random.random() < self.error_rate:
+                raise Exception("injected error")
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": self.handle(method, request.get("params", []))}
+        except KeyError:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32601, "message": f"the method {method} does not exist"}}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32000, "message": str(e)}}
+
+    async def http(self, request):
+        body = await request.json()
+        self.http_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if isinstance(body, list):
+            return web.json_response([self.respond(item) for item in body])
+        return web.json_response(self.respond(body))
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/", self.http)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", port)
+        await site.start()
+        host, port = self.runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        self.miner_task = asyncio.create_task(self.miner())
+        return self.url
+
+    async def stop(self):
+        if self.miner_task:
+            self.miner_task.cancel()
+            await asyncio.gather(self.miner_task, return_exceptions=True)
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class LoopMonitor:
+    # Sleeps in short intervals and treats any oversleep as time the event loop was blocked
+    def __init__(self, interval=LOOP_MONITOR_INTERVAL):
+        self.interval = interval
+        self.blocked = 0.0
+        self.max_block = 0.0
+        self.task = None
+
+    async def run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = time.perf_counter() - started - self.interval
+            if lag > 0.001:
+                self.blocked += lag
+                self.max_block = max(self.max_block, lag)
+
+    def start(self):
+        self.blocked, self.max_block = 0.0, 0.0
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+
+
+def make_bot(bot_module, node_url, args):
+    # The bot reads its keys from the environment, so the benchmark's throwaway keys replace any real ones
+    for name in [name for name in os.environ if name.startswith("PRIVATE_KEY_")]:
+        del os.environ[name]
+    for i in range(args.accounts):
+        os.environ[f"PRIVATE_KEY_{i + 1}"] = "0x" + keccak(text=f"satsuma-benchmark-{i}").hex()
+
+    class BenchmarkBot(bot_module.SatsumaBot):
+        def load_config(self):
+            config = super().load_config()
+            config.update(rpcs=[node_url], block_poll_interval=min(args.block_time / 2, 0.25), receipt_timeout=30)
+            return config
+
+    bot = BenchmarkBot()
+    bot.settings.update(swap_delay_range=[0, 0], swap_mode=args.swap_mode, max_concurrency=args.concurrency)
+    return bot
+
+
+async def measure(name, node, monitor, action, iterations):
+    latencies, failures = [], 0
+    calls_before, http_before = node.snapshot()
+    monitor.start()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        action_started = time.perf_counter()
+        result = await action()
+        latencies.append(time.perf_counter() - action_started)
+        if isinstance(result, dict) and not result.get("success"):
+            failures += 1
+    elapsed = time.perf_counter() - started
+    await monitor.stop()
+    calls_after, http_after = node.snapshot()
+    methods = {m: calls_after[m] - calls_before.get(m, 0) for m in calls_after if calls_after[m] != calls_before.get(m, 0)}
+    sends = methods.get("eth_sendRawTransaction", 0)
+    return {
+        "name": name,
+        "iterations": iterations,
+        "failures": failures,
+        "elapsed_s": round(elapsed, 4),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "transactions_per_second": round(sends / elapsed, 3) if elapsed else 0,
+        "rpc_calls_per_action": round(sum(methods.values()) / iterations, 2),
+        "http_requests_per_action": round((http_after - http_before) / iterations, 2),
+        "methods_per_action": {m: round(count / iterations, 2) for m, count in sorted(methods.items())},
+        "loop_blocked_ms": round(monitor.blocked * 1000, 2),
+        "loop_max_block_ms": round(monitor.max_block * 1000, 2),
+    }
+
+
+async def run_benchmark(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot as bot_module
+
+    node = FakeNode(latency=args.latency, block_time=args.block_time, error_rate=args.error_rate,
+                    multicall=not args.no_multicall, block_receipts=not args.no_block_receipts)
+    node_url = await node.start()
+    output = io.StringIO() if not args.verbose else sys.stdout
+    monitor = LoopMonitor()
+    results = []
+    with redirect_stdout(output):
+        bot = make_bot(bot_module, node_url, args)
+        await bot.connect()
+        try:
+            key = bot.private_keys[0]
+            tokens = bot.token_addresses
+            scenarios = [
+                ("show_balances", lambda: bot.show_balances(), args.iterations),
+                ("perform_swap_erc20", lambda: bot.perform_swap(key, tokens["USDC"], tokens["SUMA"], 0.001), args.iterations),
+                ("perform_swap_native", lambda: bot.perform_swap(key, tokens["cBTC"], tokens["SUMA"], 0.001), args.iterations),
+                ("add_liquidity", lambda: bot.add_liquidity(key, tokens["USDC"], tokens["SUMA"], 0.001, 0.002), args.iterations),
+            ]
+            for name, action, iterations in scenarios:
+                results.append(await measure(name, node, monitor, action, iterations))
+
+            async def automated():
+                bot.settings["transaction_count"] = args.swaps
+                await bot.start_automated_swaps()
+
+            automated_result = await measure("start_automated_swaps", node, monitor, automated, 1)
+            automated_result["swaps"] = args.swaps
+            automated_result["rpc_calls_per_swap"] = round(automated_result["rpc_calls_per_action"] / args.swaps, 2)
+            results.append(automated_result)
+        finally:
+            await bot.close()
+            await node.stop()
+    return {
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "parameters": {
+            "latency": args.latency, "block_time": args.block_time, "error_rate": args.error_rate,
+            "iterations": args.iterations, "swaps": args.swaps, "accounts": args.accounts,
+            "concurrency": args.concurrency, "swap_mode": args.swap_mode,
+            "multicall": not args.no_multicall, "block_receipts": not args.no_block_receipts
+        },
+        "scenarios": {result.pop("name"): result for result in results}
+    }
+
+
+def print_report(report, baseline=None):
+    columns = ["p50_ms", "p99_ms", "transactions_per_second", "rpc_calls_per_action", "http_requests_per_action", "loop_blocked_ms"]
+    print(f"{'scenario':<24}" + "".join(f"{column:>26}" for column in columns))
+    for name, result in report["scenarios"].items():
+        cells = []
+        for column in columns:
+            cell = f"{result[column]}"
+            previous = (baseline or {}).get("scenarios", {}).get(name, {}).get(column)
+            if previous:
+                cell += f" ({(result[column] - previous) / previous * 100:+.1f}%)"
+            cells.append(f"{cell:>26}")
+        print(f"{name:<24}" + "".join(cells))
+        if result["failures"]:
+            print(f"  {result['failures']}/{result['iterations']} iterations failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SatsumaBot against a local stand-in JSON-RPC node")
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated RPC round-trip latency in seconds")
+    parser.add_argument("--block-time", type=float, default=0.5, help="Seconds between mined blocks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of read requests that fail")
+    parser.add_argument("--iterations", type=int, default=10, help="Runs of each single-action scenario")
+    parser.add_argument("--swaps", type=int, default=20, help="Transaction count for the automated swap scenario")
+    parser.add_argument("--accounts", type=int, default=4, help="Wallets used by the automated swap scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="max_concurrency setting for the bot")
+    parser.add_argument("--swap-mode", choices=["single", "route"], default="single")
+    parser.add_argument("--no-multicall", action="store_true", help="Serve the node without Multicall3")
+    parser.add_argument("--no-block-receipts", action="store_true", help="Serve the node without eth_getBlockReceipts")
+    parser.add_argument("--output", default=RESULTS_FILE, help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own log output")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    # The bot keeps its state files in the working directory, so each benchmark starts from a clean one
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        try:
+            report = asyncio.run(run_benchmark(args))
+        finally:
+            os.chdir(cwd)
+
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print_report(report, baseline)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
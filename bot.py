@@ -1,18 +1,179 @@
-from web3 import Web3
 from dotenv import load_dotenv
+from contextlib import contextmanager
+import argparse
 import asyncio
+import contextvars
+import getpass
+import heapq
+import itertools
 import random
+import signal
+import sqlite3
 import time
+from collections import deque
 import sys
 import os
 import json
 from datetime import datetime, timedelta
 
+STARTED_AT = time.monotonic()
+
 # Load environment variables from .env file
 load_dotenv()
 
+# Time from process start to the menu being shown; the RPC connection is not part of it (seconds)
+STARTUP_BUDGET = 0.3
+# Menu options that need the chain; the rest work before the connection is up
+NETWORK_OPTIONS = {"1", "3", "4", "5", "6", "7", "8", "9"}
+
 # Configuration files
 CONFIG_FILE = "satsuma_config.json"
+GAS_PROFILE_FILE = "satsuma_gas_profiles.json"
+ALLOWANCE_INDEX_FILE = "satsuma_allowances.json"
+JOURNAL_FILE = "satsuma_journal.jsonl"
+
+# Metrics: latency histogram buckets (seconds), raw samples kept per series for quantiles, and
+# where the Prometheus endpoint listens when METRICS_PORT is set
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+METRIC_SAMPLE_WINDOW = 1000
+METRICS_HOST = "127.0.0.1"
+
+# Shared HTTP session limits for the async provider
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT = 30
+
+# RPC pool scoring: EWMA weight, latency assumed for unmeasured endpoints (seconds), how strongly
+# errors count against an endpoint, and the cooldown after consecutive transport failures
+RPC_EWMA_ALPHA = 0.2
+RPC_UNKNOWN_LATENCY = 0.5
+RPC_ERROR_PENALTY = 10
+RPC_LATENCY_WINDOW = 200
+RPC_COOLDOWN_FAILURES = 3
+RPC_COOLDOWN_SECONDS = 30
+RPC_MIN_HEDGE_DELAY = 0.05
+# Sends and pending nonce reads stay on one endpoint so nonce tracking never sees a stale view
+RPC_PINNED_METHODS = {"eth_sendRawTransaction", "eth_getTransactionCount"}
+RPC_HEDGED_METHODS = {"eth_call", "eth_getBalance", "eth_blockNumber", "eth_getBlockReceipts", "eth_getBlockByNumber", "eth_getTransactionReceipt", "eth_feeHistory", "eth_gasPrice", "eth_getCode", "eth_estimateGas"}
+RPC_STATIC_METHODS = {"eth_chainId", "net_version"}
+# Reads that may be coalesced into JSON-RPC batches, and how long to wait for companions (seconds)
+RPC_BATCHABLE_METHODS = RPC_HEDGED_METHODS | {"eth_getTransactionCount", "eth_getTransactionByHash", "eth_maxPriorityFeePerGas", "eth_getLogs"}
+RPC_BATCH_WINDOW = 0.002
+# Adaptive rate limiting per endpoint, in requests per second: the starting rate and its bounds, the
+# multiplicative cut on a 429 or timeout (at most once per interval), the additive gain per second
+# of successful traffic, and how often a throttled request is retried, after a backoff that doubles
+# each time (seconds), before it fails
+RPC_RATE_INITIAL = 50
+RPC_RATE_LIMITS = (1, 1000)
+RPC_RATE_DECREASE = 0.5
+RPC_RATE_CUT_INTERVAL = 1.0
+RPC_RATE_INCREASE = 5
+RPC_THROTTLE_RETRIES = 4
+RPC_THROTTLE_BACKOFF = 0.25
+# Sends, nonces and confirmations go ahead of every waiting read
+RPC_PRIORITY_METHODS = RPC_PINNED_METHODS | {"eth_getBlockReceipts", "eth_getTransactionReceipt", "eth_getTransactionByHash", "eth_getBlockByNumber", "eth_blockNumber"}
+
+# How often a send is retried after the node rejects its nonce
+NONCE_RETRIES = 3
+
+# Fee policies: reward percentile for the tip, headroom over the next base fee, and the
+# multiplier applied to eth_gasPrice on chains without EIP-1559
+FEE_POLICIES = {
+    "economy": {"percentile": 10, "base_fee_multiplier": 1.125, "legacy_multiplier": 1.0},
+    "normal": {"percentile": 50, "base_fee_multiplier": 1.5, "legacy_multiplier": 1.0},
+    "fast": {"percentile": 90, "base_fee_multiplier": 2.0, "legacy_multiplier": 1.2},
+}
+MIN_PRIORITY_FEE = 1
+# Stuck transactions: blocks a transaction may wait unmined before it is replaced on the same nonce,
+# the fee increase each replacement makes (basis points; nodes refuse replacements under 10%), and
+# the most any replacement may pay per gas as a multiple of the original fees. The gas limit never
+# changes, so this also caps the transaction's total fee.
+STUCK_AFTER_BLOCKS = 5
+FEE_BUMP_BPS = 1250
+FEE_BUMP_CAP = 3
+FEE_FIELDS = ("maxFeePerGas", "maxPriorityFeePerGas", "gasPrice")
+
+# Learned gas limits: samples kept per key, percentile used and the margin applied on top
+GAS_PROFILE_SAMPLES = 50
+GAS_PROFILE_PERCENTILE = 90
+GAS_PROFILE_MARGIN = 1.2
+GAS_PROFILE_SAVE_INTERVAL = 30
+
+# Limits used when neither a learned profile nor estimate_gas is available
+GAS_FALLBACKS = {"approve": 150000, "vote": 200000, "default": 500000}
+
+# Pre-send simulation: revert payload selectors, and how long an automated swap whose simulation
+# reverted waits before its single retry (seconds)
+REVERT_ERROR_SELECTOR = "0x08c379a0"  # Error(string)
+REVERT_PANIC_SELECTOR = "0x4e487b71"  # Panic(uint256)
+SIMULATION_RETRY_DELAY = 5
+
+# Local quoting: candidate sizes an automated swap chooses between, and the price impact past which
+# a quote is not trusted because the swap may leave the pool's current liquidity range (basis points)
+QUOTE_CANDIDATES = 8
+QUOTE_MAX_IMPACT_BPS = 100
+Q96 = 2 ** 96
+
+# Approval policies: approve the exact amount, a capped multiple of it, or the maximum uint256
+APPROVAL_POLICIES = ("exact", "multiple", "max")
+MAX_UINT256 = 2 ** 256 - 1
+APPROVAL_TOPIC = bytes.fromhex("8c5be1e5ebec7d5bd14f71427d1e84f3dd0314c0f7b2291e5b200ac8c7c3b925")  # Approval(address,address,uint256)
+ALLOWANCE_SAVE_INTERVAL = 30
+# An indexed allowance below this multiple of the amount needed is re-read from the chain before use
+ALLOWANCE_RECHECK_MULTIPLE = 2
+
+# How long the journal gathers events before one append + fsync covers all of them (seconds)
+JOURNAL_FLUSH_INTERVAL = 0.05
+
+# Event-log indexer: blocks per eth_getLogs request to start with, the bounds that range adapts
+# between, the response size under which it grows again, how far back a new index starts, and the
+# error text a node uses when a range is too large or returns too many logs
+INDEX_DB_FILE = "satsuma_index.db"
+INDEX_CHUNK_BLOCKS = 2000
+INDEX_CHUNK_LIMITS = (1, 50000)
+INDEX_GROW_BELOW = 1000
+INDEX_LOOKBACK_BLOCKS = 500000
+INDEX_RANGE_ERRORS = ("too many", "more than", "limit", "range", "exceed", "too large", "timeout", "response size")
+TRANSFER_TOPIC = bytes.fromhex("ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef")  # Transfer(address,address,uint256)
+INDEXED_EVENTS = {
+    TRANSFER_TOPIC: "transfer",
+    APPROVAL_TOPIC: "approval",
+    bytes.fromhex("e1fffcc4923d04b559f4d29a8bfc6cda04eb5b0d3c460751c2402c5c5cc9109c"): "wrap",  # Deposit(address,uint256)
+    bytes.fromhex("7fcf532c15f0a6db0bd6d0e038bea71d30d808c7d98cb3bf7268a95bf5081b65"): "unwrap",  # Withdrawal(address,uint256)
+    bytes.fromhex("4566dfc29f6f11d13a418c26a02bef7c28bae749d4de47e4e6a7cddea6730d59"): "lock",  # Deposit(address,uint256,uint256,int128,uint256)
+    bytes.fromhex("f279e6a1f5e320cca91135676d9cb6e44ca8a08c0b88342bcdb1144f6511b568"): "unlock",  # Withdraw(address,uint256,uint256)
+}
+
+# Range of token amounts used by automated swaps
+SWAP_AMOUNT_RANGE = (0.0001, 0.0002)
+# Intermediate legs of a bundled route spend this much less than simulated, in basis points,
+# so a small price move between simulation and inclusion does not revert the whole bundle
+ROUTE_LEG_BUFFER_BPS = 10
+
+# Headless plans: the parameters each action needs, and where the run report is written
+PLAN_ACTIONS = {
+    "swap": ("route", "amount"),
+    "add_liquidity": ("token_a", "token_b", "amount_a", "amount_b"),
+    "convert_to_vesuma": ("amount", "lock_days"),
+    "convert_vesuma_to_suma": (),
+    "stake_vesuma": ("amount",),
+    "vote_with_vesuma": ("gauge", "weight"),
+    "balances": (),
+}
+PLAN_RESULT_FILE = "satsuma_plan_result.json"
+
+# Daemon mode: the Unix socket its control API listens on unless a TCP port is given, and how many
+# finished jobs it keeps for status queries
+DAEMON_SOCKET = "satsuma.sock"
+DAEMON_JOB_HISTORY = 1000
+
+# Logging: how long the writer lets records pile up before one write, how many records may wait
+# before new ones are dropped, and how long an identical warning or error is held back after it prints
+LOG_FLUSH_INTERVAL = 0.05
+LOG_BUFFER_LIMIT = 10000
+LOG_REPEAT_WINDOW = 10
+
+# Receipt watcher limits: blocks scanned at once after a stall before falling back to direct lookups
+MAX_BLOCK_CATCHUP = 50
 
 # Terminal Colors for better visibility
 class Colors:
@@ -27,135 +188,2283 @@ class Colors:
     BRIGHT_GREEN = '\033[92m'
     BRIGHT_WHITE = '\033[97m'
 
+# Fields such as account, nonce and tx hash that every record logged from the current task carries
+LOG_CONTEXT = contextvars.ContextVar("log_context", default={})
+
 class Logger:
+    # Logging only buffers a record; a background task renders the batch and writes it from a worker
+    # thread, so a slow terminal or pipe never stalls the event loop. Before `start` and after `stop`
+    # records are written straight away. Identical warnings and errors repeating within
+    # LOG_REPEAT_WINDOW are counted instead of printed.
+    STYLES = {
+        "info": (Colors.GREEN, "✓"), "warn": (Colors.YELLOW, "!"), "error": (Colors.RED, "✗"),
+        "success": (Colors.GREEN, "+"), "processing": (Colors.CYAN, "⟳"), "step": (Colors.WHITE, "➤"),
+    }
+
+    def __init__(self):
+        self.json_path = None
+        self.buffer = []
+        self.dropped = 0
+        self.repeats = {}
+        self.task = None
+
+    def configure(self, json_path=None):
+        # `json_path` adds a JSON-lines copy of every record; "-" sends JSON lines to stdout instead of the coloured view
+        self.json_path = json_path
+
+    def info(self, msg, **fields):
+        self.emit("info", msg, fields)
+
+    def warn(self, msg, **fields):
+        self.emit("warn", msg, fields)
+
+    def error(self, msg, **fields):
+        self.emit("error", msg, fields)
+
+    def success(self, msg, **fields):
+        self.emit("success", msg, fields)
+
+    def processing(self, msg, **fields):
+        self.emit("processing", msg, fields)
+
+    def step(self, msg, **fields):
+        self.emit("step", msg, fields)
+
     @staticmethod
-    def info(msg):
-        print(f"{Colors.GREEN}[✓] {msg}{Colors.RESET}")
-    @staticmethod
-    def warn(msg):
-        print(f"{Colors.YELLOW}[!] {msg}{Colors.RESET}")
-    @staticmethod
-    def error(msg):
-        print(f"{Colors.RED}[✗] {msg}{Colors.RESET}")
-    @staticmethod
-    def success(msg):
-        print(f"{Colors.GREEN}[+] {msg}{Colors.RESET}")
-    @staticmethod
-    def processing(msg):
-        print(f"{Colors.CYAN}[⟳] {msg}{Colors.RESET}")
+    def bind(**fields):
+        LOG_CONTEXT.set({**LOG_CONTEXT.get(), **fields})
+
     @staticmethod
-    def step(msg):
-        print(f"{Colors.WHITE}[➤] {msg}{Colors.RESET}")
+    @contextmanager
+    def scope():
+        # Fields bound inside the block are dropped when it ends
+        token = LOG_CONTEXT.set(LOG_CONTEXT.get())
+        try:
+            yield
+        finally:
+            LOG_CONTEXT.reset(token)
+
+    def emit(self, level, msg, fields):
+        now = time.time()
+        record = {"time": now, "level": level, "msg": str(msg), **LOG_CONTEXT.get(), **fields}
+        if level in ("warn", "error"):
+            seen = self.repeats.get((level, record["msg"]))
+            if seen and now - seen[0] < LOG_REPEAT_WINDOW:
+                seen[1] += 1
+                return
+            if seen and seen[1]:
+                record["repeated"] = seen[1]
+            if len(self.repeats) > 1000:
+                self.repeats = {key: value for key, value in self.repeats.items() if now - value[0] < LOG_REPEAT_WINDOW}
+            self.repeats[(level, record["msg"])] = [now, 0]
+        if self.task is None:
+            self.write([record])
+            return
+        if len(self.buffer) >= LOG_BUFFER_LIMIT:
+            self.dropped += 1
+            return
+        self.buffer.append(record)
+        self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.wakeup = asyncio.Event()
+            self.lock = asyncio.Lock()
+            self.task = asyncio.create_task(self.flusher())
+
+    async def stop(self):
+        if self.task:
+            await self.flush()
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        # Identical messages still being held back are reported once at the end
+        now = time.time()
+        for (level, msg), (_, count) in self.repeats.items():
+            if count:
+                self.buffer.append({"time": now, "level": level, "msg": msg, "repeated": count})
+        self.repeats.clear()
+        self.write(self.take())
+
+    async def flush(self):
+        # Writes out everything logged so far; called before printing directly to keep the order
+        if self.task is None:
+            return
+        async with self.lock:
+            await asyncio.to_thread(self.write, self.take())
+
+    def take(self):
+        records, self.buffer = self.buffer, []
+        if self.dropped:
+            records.append({"time": time.time(), "level": "warn", "msg": f"{self.dropped} log record(s) dropped, the output could not keep up"})
+            self.dropped = 0
+        if self.task is not None:
+            self.wakeup.clear()
+        return records
+
+    def render(self, record):
+        color, symbol = self.STYLES[record["level"]]
+        repeated = f" (repeated {record['repeated']} more time(s))" if record.get("repeated") else ""
+        return f"{color}[{symbol}] {record['msg']}{repeated}{Colors.RESET}\n"
+
+    def write(self, records):
+        if not records:
+            return
+        try:
+            if self.json_path == "-":
+                sys.stdout.write("".join(json.dumps(record, default=str) + "\n" for record in records))
+            else:
+                sys.stdout.write("".join(self.render(record) for record in records))
+                if self.json_path:
+                    with open(self.json_path, 'a') as f:
+                        f.writelines(json.dumps(record, default=str) + "\n" for record in records)
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass  # there is nowhere left to report a failure to log
+
+    async def flusher(self):
+        while True:
+            await self.wakeup.wait()
+            # Let records from concurrent actions pile up so they go out in one write
+            await asyncio.sleep(LOG_FLUSH_INTERVAL)
+            await self.flush()
 
 log = Logger()
 
-# Standard ERC20 ABI for token interactions (balance, approval)
-ERC20_ABI = [
-    {"constant": False, "inputs": [{"name": "spender", "type": "address"}, {"name": "amount", "type": "uint256"}], "name": "approve", "outputs": [{"name": "", "type": "bool"}], "type": "function"},
-    {"constant": True, "inputs": [{"name": "owner", "type": "address"}], "name": "balanceOf", "outputs": [{"name": "", "type": "uint256"}], "type": "function"},
-    {"constant": True, "inputs": [{"name": "owner", "type": "address"}, {"name": "spender", "type": "address"}], "name": "allowance", "outputs": [{"name": "", "type": "uint256"}], "type": "function"},
-    {"constant": True, "inputs": [], "name": "decimals", "outputs": [{"name": "", "type": "uint8"}], "type": "function"},
-    {"constant": True, "inputs": [], "name": "symbol", "outputs": [{"name": "", "type": "string"}], "type": "function"}
-]
+def load_json_file(path, default, label):
+    try:
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                return json.load(f)
+    except Exception as e:
+        log.warn(f"Failed to load {label}: {e}")
+    return default
+
+def save_json_file(path, data, label):
+    # Write to a temporary file first so a crash never leaves a truncated file behind
+    try:
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+        return True
+    except Exception as e:
+        log.warn(f"Failed to save {label}: {e}")
+        return False
+
+def decrypt_keystore(path, password):
+    # Runs in a worker process: the keystore's scrypt/pbkdf2 derivation is CPU-bound and holds the GIL
+    from eth_account import Account
+    with open(path, 'r') as f:
+        keyfile = json.load(f)
+    return "0x" + bytes(Account.decrypt(keyfile, password)).hex()
 
-# Minimal ABI for the SWAP_ROUTER, including `exactInputSingle` and `multicall`
-SWAP_ROUTER_ABI = [
+def load_web3():
+    # web3 and aiohttp make up most of the import time, so they are loaded only once a command
+    # actually talks to the chain; the menu and settings paths never pay for them
+    global AsyncWeb3, Web3, ContractLogicError, ProviderConnectionError, TimeExhausted, TransactionNotFound, aiohttp, web, RPCPoolProvider
+    if "RPCPoolProvider" in globals():
+        return
+    from web3 import AsyncWeb3, Web3
+    from web3.exceptions import ContractLogicError, ProviderConnectionError, TimeExhausted, TransactionNotFound
+    from web3.providers.async_base import AsyncJSONBaseProvider
+    from aiohttp import web
+    import aiohttp
+
+    class RPCPoolProvider(RPCPool, AsyncJSONBaseProvider):
+        pass
+
+# Multicall3 is deployed at the same address on most EVM chains
+MULTICALL3_ADDRESS = "0xcA11bde05977b3631167028862bE2a173976CA11"
+MULTICALL3_ABI = [
     {
-        "inputs": [
-            {"components": [{"internalType": "address", "name": "tokenIn", "type": "address"}, {"internalType": "address", "name": "tokenOut", "type": "address"}, {"internalType": "address", "name": "deployer", "type": "address"}, {"internalType": "address", "name": "recipient", "type": "address"}, {"internalType": "uint256", "name": "deadline", "type": "uint256"}, {"internalType": "uint256", "name": "amountIn", "type": "uint256"}, {"internalType": "uint256", "name": "amountOutMinimum", "type": "uint256"}, {"internalType": "uint160", "name": "limitSqrtPrice", "type": "uint160"}], "internalType": "struct ISwapRouter.ExactInputSingleParams", "name": "params", "type": "tuple"}
-        ],
-        "name": "exactInputSingle",
-        "outputs": [{"internalType": "uint256", "name": "amountOut", "type": "uint256"}],
+        "inputs": [{"components": [{"internalType": "address", "name": "target", "type": "address"}, {"internalType": "bool", "name": "allowFailure", "type": "bool"}, {"internalType": "bytes", "name": "callData", "type": "bytes"}], "internalType": "struct Multicall3.Call3[]", "name": "calls", "type": "tuple[]"}],
+        "name": "aggregate3",
+        "outputs": [{"components": [{"internalType": "bool", "name": "success", "type": "bool"}, {"internalType": "bytes", "name": "returnData", "type": "bytes"}], "internalType": "struct Multicall3.Result[]", "name": "returnData", "type": "tuple[]"}],
         "stateMutability": "payable",
         "type": "function"
     },
-    {
-        "inputs": [{"internalType": "bytes[]", "name": "data", "type": "bytes[]"}],
-        "name": "multicall",
-        "outputs": [{"internalType": "bytes[]", "name": "results", "type": "bytes[]"}],
-        "stateMutability": "payable",
-        "type": "function"
-    }
+    {"inputs": [{"internalType": "address", "name": "addr", "type": "address"}], "name": "getEthBalance", "outputs": [{"internalType": "uint256", "name": "balance", "type": "uint256"}], "stateMutability": "view", "type": "function"}
 ]
 
-# Minimal ABI for the veSUMA contract, including `locked` function for checking lock time
-VESUMA_ABI = [
-    {
-        "name": "locked",
-        "inputs": [{"name": "arg0", "type": "address"}],
-        "outputs": [
-            {"name": "amount", "type": "uint256"},
-            {"name": "end", "type": "uint256"}
-        ],
-        "stateMutability": "view",
-        "type": "function"
-    }
-]
 
-# Minimal ABI for the Liquidity Router
-LIQUIDITY_ROUTER_ABI = [
-    {
-        "inputs": [{"internalType": "address", "name": "tokenA", "type": "address"}, {"internalType": "address", "name": "tokenB", "type": "address"}, {"internalType": "address", "name": "recipient", "type": "address"}, {"internalType": "uint256", "name": "amountA", "type": "uint256"}, {"internalType": "uint256", "name": "amountB", "type": "uint256"}, {"internalType": "uint256", "name": "amountAMin", "type": "uint256"}, {"internalType": "uint256", "name": "amountBMin", "type": "uint256"}, {"internalType": "uint256", "name": "deadline", "type": "uint256"}], "name": "addLiquidity", "outputs": [], "stateMutability": "payable", "type": "function"
-    }
-]
+class Histogram:
+    # Cumulative buckets for the Prometheus exporter plus a bounded window of raw samples for quantiles
+    def __init__(self, buckets=METRIC_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=METRIC_SAMPLE_WINDOW)
 
-# Minimal ABI for Staking and Voting contracts
-STAKING_VOTING_ABI = [
-    {"inputs": [{"internalType": "uint256", "name": "_value", "type": "uint256"}], "name": "stake", "outputs": [], "stateMutability": "nonpayable", "type": "function"},
-    {"inputs": [{"internalType": "address", "name": "_gauge_addr", "type": "address"}, {"internalType": "uint256", "name": "_weight", "type": "uint256"}], "name": "vote", "outputs": [], "stateMutability": "nonpayable", "type": "function"}
-]
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Metrics:
+    # Per-RPC-method call counts, errors and latency, HTTP posts per endpoint, and timed spans for
+    # the stages of each action. Exposed as Prometheus text and printed as a summary on shutdown.
+    def __init__(self):
+        self.rpc_calls = {}
+        self.rpc_errors = {}
+        self.rpc_latency = {}
+        self.http_requests = {}
+        self.rpc_throttled = {}
+        self.rpc_rates = {}
+        self.span_errors = {}
+        self.spans = {}
+        self.runner = None
+
+    def observe_rpc(self, method, seconds, failed):
+        self.rpc_calls[method] = self.rpc_calls.get(method, 0) + 1
+        if failed:
+            self.rpc_errors[method] = self.rpc_errors.get(method, 0) + 1
+        self.rpc_latency.setdefault(method, Histogram()).observe(seconds)
+
+    def observe_http(self, url, rate):
+        self.http_requests[url] = self.http_requests.get(url, 0) + 1
+        self.rpc_rates[url] = rate
+
+    def observe_throttle(self, url):
+        self.rpc_throttled[url] = self.rpc_throttled.get(url, 0) + 1
+
+    @contextmanager
+    def span(self, name):
+        started = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.spans.setdefault(name, Histogram()).observe(time.monotonic() - started)
+            if failed:
+                self.span_errors[name] = self.span_errors.get(name, 0) + 1
+
+    def render(self):
+        lines = []
+
+        def histogram(name, label, key, hist):
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f'{name}_bucket{{{label}="{key}",le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum{{{label}="{key}"}} {hist.sum}')
+            lines.append(f'{name}_count{{{label}="{key}"}} {hist.count}')
+
+        lines += ["# HELP satsuma_rpc_requests_total JSON-RPC requests by method", "# TYPE satsuma_rpc_requests_total counter"]
+        lines += [f'satsuma_rpc_requests_total{{method="{m}"}} {n}' for m, n in sorted(self.rpc_calls.items())]
+        lines += ["# HELP satsuma_rpc_errors_total JSON-RPC requests that failed or returned an error", "# TYPE satsuma_rpc_errors_total counter"]
+        lines += [f'satsuma_rpc_errors_total{{method="{m}"}} {n}' for m, n in sorted(self.rpc_errors.items())]
+        lines += ["# HELP satsuma_rpc_latency_seconds JSON-RPC latency by method", "# TYPE satsuma_rpc_latency_seconds histogram"]
+        for method, hist in sorted(self.rpc_latency.items()):
+            histogram("satsuma_rpc_latency_seconds", "method", method, hist)
+        lines += ["# HELP satsuma_http_requests_total HTTP posts (single or batched) by endpoint", "# TYPE satsuma_http_requests_total counter"]
+        lines += [f'satsuma_http_requests_total{{endpoint="{u}"}} {n}' for u, n in sorted(self.http_requests.items())]
+        lines += ["# HELP satsuma_rpc_throttled_total Responses that were a 429 or timed out, by endpoint", "# TYPE satsuma_rpc_throttled_total counter"]
+        lines += [f'satsuma_rpc_throttled_total{{endpoint="{u}"}} {n}' for u, n in sorted(self.rpc_throttled.items())]
+        lines += ["# HELP satsuma_rpc_rate_limit Current adaptive request rate limit by endpoint (requests per second)", "# TYPE satsuma_rpc_rate_limit gauge"]
+        lines += [f'satsuma_rpc_rate_limit{{endpoint="{u}"}} {r:.2f}' for u, r in sorted(self.rpc_rates.items())]
+        lines += ["# HELP satsuma_span_seconds Duration of action stages", "# TYPE satsuma_span_seconds histogram"]
+        for name, hist in sorted(self.spans.items()):
+            histogram("satsuma_span_seconds", "span", name, hist)
+        lines += ["# HELP satsuma_span_errors_total Action stages that raised", "# TYPE satsuma_span_errors_total counter"]
+        lines += [f'satsuma_span_errors_total{{span="{s}"}} {n}' for s, n in sorted(self.span_errors.items())]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port, host=METRICS_HOST):
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        log.info(f"Metrics available at http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def summary(self):
+        if not self.rpc_calls:
+            return
+        print(f"\n{Colors.CYAN}=== RPC Summary ==={Colors.RESET}")
+        print(f"{Colors.WHITE}{'method':<28}{'calls':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}{Colors.RESET}")
+        for method, hist in sorted(self.rpc_latency.items(), key=lambda item: -item[1].sum):
+            print(f"{method:<28}{self.rpc_calls[method]:>8}{self.rpc_errors.get(method, 0):>8}"
+                  f"{hist.quantile(0.5) * 1000:>10.1f}{hist.quantile(0.99) * 1000:>10.1f}{hist.sum:>10.2f}")
+        print(f"{Colors.WHITE}{'HTTP requests':<28}{sum(self.http_requests.values()):>8}{Colors.RESET}")
+        if self.rpc_throttled:
+            rates = ", ".join(f"{rate:.1f}/s" for rate in self.rpc_rates.values())
+            print(f"{Colors.WHITE}{'Throttled responses':<28}{sum(self.rpc_throttled.values()):>8}  rate limit now {rates}{Colors.RESET}")
+        if self.spans:
+            print(f"\n{Colors.CYAN}=== Action Stages ==={Colors.RESET}")
+            print(f"{Colors.WHITE}{'stage':<28}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p99 ms':>10}{'total s':>10}{Colors.RESET}")
+            for name, hist in sorted(self.spans.items()):
+                print(f"{name:<28}{hist.count:>8}{self.span_errors.get(name, 0):>8}"
+                      f"{hist.quantile(0.5) * 1000:>10.1f}{hist.quantile(0.99) * 1000:>10.1f}{hist.sum:>10.2f}")
+
+
+class RateLimiter:
+    # Token bucket in front of one endpoint. Its rate adapts AIMD-style: cut multiplicatively when the
+    # endpoint throttles (429 or timeout) and raised by RPC_RATE_INCREASE per second of successful
+    # traffic. Waiting priority requests (sends, nonces, confirmations) are always served first.
+    def __init__(self, rate=RPC_RATE_INITIAL):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.cut_at = 0
+        self.lanes = (deque(), deque())
+        self.timer = None
+
+    def refill(self):
+        # The bucket holds at most one second's worth of requests
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost=1, priority=False):
+        self.refill()
+        ahead = self.lanes[0] if priority else self.lanes[0] or self.lanes[1]
+        if not ahead and self.tokens >= min(cost, self.rate) and time.monotonic() >= self.paused_until:
+            self.tokens -= cost
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.lanes[0 if priority else 1].append((cost, future))
+        self.serve()
+        await future
+
+    def serve(self):
+        if self.timer:
+            self.timer.cancel()
+        self.timer = None
+        self.refill()
+        while True:
+            for lane in self.lanes:
+                while lane and lane[0][1].done():
+                    lane.popleft()  # the caller was cancelled, e.g. the losing side of a hedge
+            lane = self.lanes[0] or self.lanes[1]
+            if not lane:
+                return
+            cost, future = lane[0]
+            wait = max(self.paused_until - time.monotonic(), (min(cost, self.rate) - self.tokens) / self.rate)
+            if wait > 0:
+                self.timer = asyncio.get_running_loop().call_later(wait, self.serve)
+                return
+            lane.popleft()
+            self.tokens -= cost
+            future.set_result(None)
+
+    def throttle(self, retry_after=None):
+        # Returns True when this throttle cut the rate; a burst of 429s from requests already in
+        # flight counts as one signal
+        now = time.monotonic()
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+        if now - self.cut_at < RPC_RATE_CUT_INTERVAL:
+            return False
+        self.rate = max(RPC_RATE_LIMITS[0], self.rate * RPC_RATE_DECREASE)
+        self.tokens = min(self.tokens, 0)
+        self.cut_at = now
+        return True
+
+    def succeed(self, cost=1):
+        self.rate = min(RPC_RATE_LIMITS[1], self.rate + RPC_RATE_INCREASE * cost / self.rate)
+
+
+class RPCEndpoint:
+    # Health of one RPC URL: exponentially weighted latency and error rate plus a short
+    # cooldown after repeated transport failures.
+    def __init__(self, url):
+        self.url = url
+        self.latency = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=RPC_LATENCY_WINDOW)
+        self.failures = 0
+        self.cooldown_until = 0
+        self.limiter = RateLimiter()
+
+    def score(self):
+        if time.monotonic() < self.cooldown_until:
+            return float("inf")
+        latency = self.latency if self.latency is not None else RPC_UNKNOWN_LATENCY
+        return latency * (1 + RPC_ERROR_PENALTY * self.error_rate)
+
+    def p95(self):
+        if not self.samples:
+            return RPC_UNKNOWN_LATENCY
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def record_success(self, latency):
+        self.samples.append(latency)
+        self.latency = latency if self.latency is None else self.latency + RPC_EWMA_ALPHA * (latency - self.latency)
+        self.error_rate -= RPC_EWMA_ALPHA * self.error_rate
+        self.failures = 0
+
+    def record_failure(self):
+        self.error_rate += RPC_EWMA_ALPHA * (1 - self.error_rate)
+        self.failures += 1
+        if self.failures >= RPC_COOLDOWN_FAILURES:
+            self.cooldown_until = time.monotonic() + RPC_COOLDOWN_SECONDS
+
+
+class RPCPool:
+    # Provider logic for RPCPoolProvider, which `load_web3` builds on web3's AsyncJSONBaseProvider.
+    # Spreads requests over several endpoints ranked by health score, fails over on transport
+    # errors and can hedge idempotent reads. Nonce-sensitive traffic (raw sends and pending
+    # transaction counts) is pinned to one endpoint so it always sees its own broadcasts.
+    def __init__(self, urls, hedge=True, batch_window=RPC_BATCH_WINDOW, metrics=None, **kwargs):
+        super().__init__(**kwargs)
+        if not urls:
+            raise ValueError("At least one RPC endpoint is required")
+        self.endpoints = [RPCEndpoint(url) for url in urls]
+        self.hedge = hedge
+        self.session = None
+        self.pinned = self.endpoints[0]
+        self.static_responses = {}
+        self.batch_window = batch_window
+        self.batch_queue = []
+        self.batch_handle = None
+        self.metrics = metrics or Metrics()
+
+    def use_session(self, session):
+        self.session = session
+
+    def ranked(self):
+        return sorted(self.endpoints, key=lambda endpoint: endpoint.score())
+
+    async def post(self, endpoint, request_data, cost=1, priority=False):
+        # `cost` is the number of JSON-RPC calls in the POST. A 429 or a timeout slows the endpoint's
+        # limiter down and the same request is retried there, rather than failing the action.
+        for attempt in range(RPC_THROTTLE_RETRIES + 1):
+            await endpoint.limiter.acquire(cost, priority)
+            started = time.monotonic()
+            self.metrics.observe_http(endpoint.url, endpoint.limiter.rate)
+            try:
+                async with self.session.post(endpoint.url, data=request_data, headers={"Content-Type": "application/json"}) as response:
+                    if response.status == 429 or response.status >= 500:
+                        raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status, message=response.reason, headers=response.headers)
+                    response.raise_for_status()
+                    raw_response = await response.read()
+                # Some nodes report rate limiting as a JSON-RPC error in a 200 response
+                if len(raw_response) < 512 and (b"-32005" in raw_response or b"rate limit" in raw_response.lower()):
+                    raise aiohttp.ClientResponseError(response.request_info, response.history, status=429, message="rate limited", headers=response.headers)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # A timeout is retried only once, since each one already cost a full HTTP_TIMEOUT
+                throttled = getattr(e, "status", None) == 429 or (isinstance(e, asyncio.TimeoutError) and attempt == 0)
+                if not throttled or attempt == RPC_THROTTLE_RETRIES:
+                    endpoint.record_failure()
+                    raise
+                self.metrics.observe_throttle(endpoint.url)
+                if endpoint.limiter.throttle(self.retry_after(e)):
+                    log.warn(f"RPC {endpoint.url} is throttling, request rate cut to {endpoint.limiter.rate:.1f}/s")
+                await asyncio.sleep(RPC_THROTTLE_BACKOFF * 2 ** attempt * random.uniform(0.5, 1))
+                continue
+            endpoint.limiter.succeed(cost)
+            endpoint.record_success(time.monotonic() - started)
+            return raw_response
+
+    @staticmethod
+    def retry_after(error):
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return float(headers.get("Retry-After", 0))
+        except ValueError:
+            return 0  # an HTTP date; the rate cut alone has to do
+
+    async def post_with_failover(self, endpoints, request_data, cost=1, priority=False):
+        last_error = None
+        for endpoint in endpoints:
+            try:
+                return await self.post(endpoint, request_data, cost, priority)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = e
+                log.warn(f"RPC {endpoint.url} failed ({type(e).__name__}: {e}), failing over")
+        raise ProviderConnectionError(f"All RPC endpoints failed: {last_error}")
+
+    async def post_hedged(self, endpoints, request_data, cost=1, priority=False):
+        # Fire at the best endpoint; if it has not answered within its p95, also ask the runner-up
+        primary, backup = endpoints[0], endpoints[1]
+        first = asyncio.ensure_future(self.post(primary, request_data, cost, priority))
+        done, _ = await asyncio.wait({first}, timeout=max(primary.p95(), RPC_MIN_HEDGE_DELAY))
+        if done and not first.exception():
+            return first.result()
+        tasks = {first} if not done else set()
+        tasks.add(asyncio.ensure_future(self.post(backup, request_data, cost, priority)))
+        try:
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if not task.exception():
+                        return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return await self.post_with_failover(endpoints[2:] or endpoints[:1], request_data, cost, priority)
+
+    async def send_pinned(self, request_data, cost=1):
+        try:
+            return await self.post(self.pinned, request_data, cost, priority=True)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Re-broadcasting the same signed transaction elsewhere is safe: it has the same hash
+            fallback = [endpoint for endpoint in self.ranked() if endpoint is not self.pinned]
+            if not fallback:
+                raise ProviderConnectionError(f"Pinned RPC {self.pinned.url} failed: {e}")
+            log.warn(f"Pinned RPC {self.pinned.url} failed, moving sends to {fallback[0].url}")
+            self.pinned = fallback[0]
+            return await self.post_with_failover(fallback, request_data, cost, priority=True)
+
+    async def make_request(self, method, params):
+        if method in RPC_STATIC_METHODS and method in self.static_responses:
+            return dict(self.static_responses[method])
+        started = time.monotonic()
+        try:
+            if self.batch_window and method in RPC_BATCHABLE_METHODS:
+                response = await self.enqueue(method, params)
+            else:
+                response = self.decode_rpc_response(await self.request(method, self.encode_rpc_request(method, params)))
+        except Exception:
+            self.metrics.observe_rpc(method, time.monotonic() - started, True)
+            raise
+        self.metrics.observe_rpc(method, time.monotonic() - started, "error" in response)
+        if method in RPC_STATIC_METHODS and "result" in response:
+            self.static_responses[method] = response
+        return response
+
+    async def request(self, method, request_data):
+        if method in RPC_PINNED_METHODS:
+            return await self.send_pinned(request_data)
+        endpoints = self.ranked()
+        priority = method in RPC_PRIORITY_METHODS
+        if self.hedge and method in RPC_HEDGED_METHODS and len(endpoints) > 1:
+            return await self.post_hedged(endpoints, request_data, priority=priority)
+        return await self.post_with_failover(endpoints, request_data, priority=priority)
+
+    async def enqueue(self, method, params):
+        # Reads issued within `batch_window` seconds of each other share one JSON-RPC batch POST
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.batch_queue.append((method, params, future))
+        if self.batch_handle is None:
+            self.batch_handle = loop.call_later(self.batch_window, lambda: asyncio.ensure_future(self.flush_batch()))
+        return await future
+
+    async def flush_batch(self):
+        batch, self.batch_queue = self.batch_queue, []
+        self.batch_handle = None
+        pinned = [item for item in batch if item[0] in RPC_PINNED_METHODS]
+        pooled = [item for item in batch if item[0] not in RPC_PINNED_METHODS]
+        if pinned and pooled and self.ranked()[0] is self.pinned:
+            # The pinned endpoint is also the best one, so everything fits in a single POST
+            groups = [(batch, True)]
+        else:
+            groups = [(group, group is pinned) for group in (pinned, pooled) if group]
+        await asyncio.gather(*[self.post_batch(group, to_pinned) for group, to_pinned in groups])
+
+    async def post_batch(self, group, to_pinned):
+        if len(group) == 1:
+            method, params, future = group[0]
+            try:
+                response = self.decode_rpc_response(await self.request(method, self.encode_rpc_request(method, params)))
+                if not future.done():
+                    future.set_result(response)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        rpc_dicts = [self.form_request(method, params) for method, params, _ in group]
+        request_data = b"[" + b",".join(self.encode_rpc_dict(rpc_dict) for rpc_dict in rpc_dicts) + b"]"
+        try:
+            if to_pinned:
+                raw_response = await self.send_pinned(request_data, len(group))
+            else:
+                priority = any(method in RPC_PRIORITY_METHODS for method, _, _ in group)
+                raw_response = await self.post_with_failover(self.ranked(), request_data, len(group), priority)
+            responses = self.decode_rpc_response(raw_response)
+        except Exception as e:
+            for _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if not isinstance(responses, list):
+            # The node rejected the batch as a whole; stop batching and replay the requests one by one
+            log.warn("RPC endpoint does not accept JSON-RPC batches, sending requests individually")
+            self.batch_window = 0
+            await asyncio.gather(*[self.post_batch([item], to_pinned) for item in group])
+            return
+        by_id = {response.get("id"): response for response in responses}
+        for rpc_dict, (method, params, future) in zip(rpc_dicts, group):
+            response = by_id.get(rpc_dict["id"])
+            if future.done():
+                continue
+            if response is None:
+                future.set_exception(ProviderConnectionError(f"Missing response for {method} in JSON-RPC batch"))
+            else:
+                future.set_result(response)
+
+    async def probe(self):
+        # Seed latency scores and pick the pinned endpoint from the fastest healthy one
+        request_data = self.encode_rpc_request("eth_blockNumber", [])
+        results = await asyncio.gather(*[self.post(endpoint, request_data, priority=True) for endpoint in self.endpoints], return_exceptions=True)
+        healthy = [endpoint for endpoint, result in zip(self.endpoints, results) if not isinstance(result, Exception)]
+        if healthy:
+            self.pinned = min(healthy, key=lambda endpoint: endpoint.score())
+        return healthy
+
+
+class CalldataTemplate:
+    # Precompiled calldata for functions whose arguments are all static 32-byte words. The selector
+    # and constant fields are laid out once; each call copies the template and patches the rest.
+    # The layout is compiled on first use, since hashing the signature needs web3 loaded.
+    def __init__(self, signature, constants=None, selector=None):
+        self.signature = signature
+        self.selector = bytes.fromhex(selector[2:]) if selector else None
+        arguments = signature[signature.index("(") + 1:signature.rindex(")")].replace("(", "").replace(")", "")
+        self.types = arguments.split(",") if arguments else []
+        self.constants = constants or {}
+        self.base = None
+        self.variable = [i for i in range(len(self.types)) if i not in self.constants]
+
+    def compile(self):
+        if self.selector is None:
+            self.selector = bytes(Web3.keccak(text=self.signature)[:4])
+        self.base = bytearray(self.selector + bytes(32 * len(self.types)))
+        for index, value in self.constants.items():
+            self.patch(self.base, index, value)
+
+    def patch(self, data, index, value):
+        offset = 4 + 32 * index
+        if self.types[index] == "address":
+            data[offset + 12:offset + 32] = bytes.fromhex(value[2:])
+        else:
+            data[offset:offset + 32] = int(value).to_bytes(32, "big")
+
+    def encode(self, *values):
+        if len(values) != len(self.variable):
+            raise ValueError(f"Expected {len(self.variable)} arguments, got {len(values)}")
+        if self.base is None:
+            self.compile()
+        data = bytearray(self.base)
+        for index, value in zip(self.variable, values):
+            self.patch(data, index, value)
+        return bytes(data)
+
+
+# Hot-path calldata. exactInputSingle always uses the default pool deployer and no price limit.
+ZERO_ADDRESS = "0x0000000000000000000000000000000000000000"
+APPROVE_CALLDATA = CalldataTemplate("approve(address,uint256)")
+EXACT_INPUT_SINGLE_CALLDATA = CalldataTemplate(
+    "exactInputSingle((address,address,address,address,uint256,uint256,uint256,uint160))",
+    constants={2: ZERO_ADDRESS, 7: 0}
+)
+ADD_LIQUIDITY_CALLDATA = CalldataTemplate("addLiquidity(address,address,address,uint256,uint256,uint256,uint256,uint256)")
+CREATE_LOCK_CALLDATA = CalldataTemplate("create_lock(uint256,uint256)", selector="0x12e82674")
+UNWRAP_NATIVE_CALLDATA = CalldataTemplate("unwrapWNativeToken(uint256,address)")
+REFUND_NATIVE_CALLDATA = CalldataTemplate("refundNativeToken()")
+ROUTER_MULTICALL_SELECTOR = bytes.fromhex("ac9650d8")  # multicall(bytes[])
+STAKE_CALLDATA = CalldataTemplate("stake(uint256)")
+VOTE_CALLDATA = CalldataTemplate("vote(address,uint256)")
+
+
+class ReadCall:
+    # A single view call: `signature` is the canonical function signature, e.g. "balanceOf(address)"
+    signatures = {}
+
+    def __init__(self, target, signature, args, output_types):
+        self.target = target
+        self.signature = signature
+        self.args = args
+        self.output_types = output_types
+        # Selectors and input types are parsed once per signature rather than once per call
+        parsed = ReadCall.signatures.get(signature)
+        if parsed is None:
+            input_types = signature[signature.index("(") + 1:-1].split(",") if not signature.endswith("()") else []
+            parsed = (Web3.keccak(text=signature)[:4], input_types)
+            ReadCall.signatures[signature] = parsed
+        self.selector, self.input_types = parsed
+
+    def encode(self, codec):
+        return self.selector + codec.encode(self.input_types, self.args)
+
+    def decode(self, codec, data):
+        values = codec.decode(self.output_types, data)
+        return values[0] if len(values) == 1 else values
+
+
+class MulticallReader:
+    # Folds every view call issued in the same loop iteration into one Multicall3 `aggregate3`.
+    # Falls back to individual eth_calls when the multicall contract is not deployed.
+    def __init__(self, w3, address=MULTICALL3_ADDRESS):
+        self.w3 = w3
+        self.address = Web3.to_checksum_address(address)
+        self.contract = w3.eth.contract(address=self.address, abi=MULTICALL3_ABI)
+        self.available = None
+        self.pending = []
+        self.flush_scheduled = False
+
+    def native_balance(self, account_address):
+        return ReadCall(self.address, "getEthBalance(address)", [account_address], ["uint256"])
+
+    async def read(self, calls):
+        # Returns one decoded value per call, or None where that call failed
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((calls, future))
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            loop.call_soon(lambda: asyncio.ensure_future(self.flush()))
+        return await future
+
+    async def flush(self):
+        batch, self.pending = self.pending, []
+        self.flush_scheduled = False
+        calls = [call for group, _ in batch for call in group]
+        try:
+            results = await self.execute(calls)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for group, future in batch:
+            if not future.done():
+                future.set_result(results[offset:offset + len(group)])
+            offset += len(group)
+
+    async def execute(self, calls):
+        if self.available is None:
+            code = await self.w3.eth.get_code(self.address)
+            self.available = len(code) > 0
+            if not self.available:
+                log.warn("Multicall3 not deployed on this chain, falling back to individual calls")
+        if self.available:
+            try:
+                payload = [(call.target, True, call.encode(self.w3.codec)) for call in calls]
+                returned = await self.contract.functions.aggregate3(payload).call()
+                return [self.decode_result(call, ok, data) for call, (ok, data) in zip(calls, returned)]
+            except Exception as e:
+                log.warn(f"Multicall failed, falling back to individual calls: {e}")
+        return await asyncio.gather(*[self.execute_single(call) for call in calls])
+
+    async def execute_single(self, call):
+        try:
+            if call.target == self.address and call.signature == "getEthBalance(address)":
+                return await self.w3.eth.get_balance(call.args[0])
+            data = await self.w3.eth.call({"to": call.target, "data": call.encode(self.w3.codec)})
+            return call.decode(self.w3.codec, data)
+        except Exception:
+            return None
+
+    def decode_result(self, call, ok, data):
+        if not ok or not data:
+            return None
+        try:
+            return call.decode(self.w3.codec, data)
+        except Exception:
+            return None
+
+
+class NonceManager:
+    # Hands out nonces locally per account. Each account is synced once against its
+    # `pending` transaction count and resynced only when the node rejects a nonce.
+    def __init__(self, w3):
+        self.w3 = w3
+        self.next_nonce = {}
+        self.released = {}
+        self.locks = {}
+
+    def lock_for(self, address):
+        if address not in self.locks:
+            self.locks[address] = asyncio.Lock()
+        return self.locks[address]
+
+    async def sync(self, address):
+        if address in self.next_nonce:
+            return
+        async with self.lock_for(address):
+            await self.sync_locked(address)
+
+    async def sync_locked(self, address):
+        if address not in self.next_nonce:
+            self.next_nonce[address] = await self.w3.eth.get_transaction_count(address, "pending")
+            self.released[address] = []
+
+    async def allocate(self, address):
+        async with self.lock_for(address):
+            await self.sync_locked(address)
+            if self.released[address]:
+                return heapq.heappop(self.released[address])
+            nonce = self.next_nonce[address]
+            self.next_nonce[address] += 1
+            return nonce
+
+    def release(self, address, nonce):
+        # Give back a nonce that was never broadcast so it does not leave a gap
+        if address not in self.next_nonce:
+            return
+        if nonce == self.next_nonce[address] - 1:
+            self.next_nonce[address] = nonce
+        elif nonce not in self.released[address]:
+            heapq.heappush(self.released[address], nonce)
+
+    async def resync(self, address):
+        async with self.lock_for(address):
+            self.next_nonce[address] = await self.w3.eth.get_transaction_count(address, "pending")
+            self.released[address] = []
+
+
+class ReceiptWatcher:
+    # Follows new blocks and resolves every pending transaction from the block that includes it,
+    # so receipt traffic scales with the number of blocks, not with the transactions in flight.
+    def __init__(self, w3, poll_interval=1.0, confirmations=1, timeout=180):
+        self.w3 = w3
+        self.poll_interval = poll_interval
+        self.confirmations = confirmations
+        self.timeout = timeout
+        self.pending = {}
+        self.included = {}
+        self.unchecked = set()
+        self.head = None
+        self.block_receipts_supported = True
+        self.wakeup = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def key_for(self, tx_hash):
+        return tx_hash.lower() if isinstance(tx_hash, str) else self.w3.to_hex(tx_hash)
+
+    def track(self, tx_hash):
+        # Register a hash before it is broadcast so no block can include it unseen
+        key = self.key_for(tx_hash)
+        if key not in self.pending:
+            self.pending[key] = asyncio.get_running_loop().create_future()
+        self.start()
+        self.wakeup.set()
+        return self.pending[key]
+
+    def untrack(self, tx_hash):
+        future = self.pending.pop(self.key_for(tx_hash), None)
+        if future and not future.done():
+            future.cancel()
+
+    async def wait(self, tx_hash, timeout=None):
+        key = self.key_for(tx_hash)
+        if key not in self.pending:
+            # Hashes that were not tracked before broadcast may already be mined, so look them up once
+            self.unchecked.add(key)
+        future = self.track(key)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeExhausted(f"Transaction {key} is not in the chain after {timeout or self.timeout} seconds")
+        finally:
+            if future.done():
+                self.pending.pop(key, None)
+
+    async def run(self):
+        while True:
+            if not self.waiting_hashes() and not self.included:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                # Everything now waiting was tracked after this point, so blocks mined while idle are skipped
+                self.head = None
+            try:
+                await self.poll()
+            except Exception as e:
+                log.warn(f"Receipt watcher error: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        head = await self.w3.eth.block_number
+        if self.head is None:
+            # A hash tracked at wakeup may have been mined before this first read, so look it up once
+            self.head = head - 1
+            self.unchecked |= self.waiting_hashes()
+        first = max(self.head + 1, head - MAX_BLOCK_CATCHUP + 1)
+        if first > self.head + 1:
+            # Blocks before the catch-up window are never scanned, so look up what is waiting directly
+            self.unchecked |= self.waiting_hashes()
+        if self.unchecked:
+            checks, self.unchecked = list(self.unchecked), set()
+            await asyncio.gather(*[self.check_single(key) for key in checks])
+        for number in range(first, head + 1):
+            if self.waiting_hashes():
+                await self.process_block(number)
+        self.head = max(self.head, head)
+        self.resolve_confirmed()
+
+    def waiting_hashes(self):
+        return {key for key, future in self.pending.items() if not future.done() and key not in self.included}
+
+    async def process_block(self, number):
+        waiting = self.waiting_hashes()
+        receipts = None
+        if self.block_receipts_supported:
+            try:
+                receipts = await self.w3.eth.get_block_receipts(number)
+            except Exception as e:
+                message = str(e).lower()
+                if "not found" in message or "not supported" in message or "does not exist" in message or "-32601" in message:
+                    log.warn("Node does not support eth_getBlockReceipts, fetching receipts per included transaction")
+                    self.block_receipts_supported = False
+        if receipts is None:
+            block = await self.w3.eth.get_block(number)
+            matches = [key for key in map(self.key_for, block["transactions"]) if key in waiting]
+            receipts = await asyncio.gather(*[self.w3.eth.get_transaction_receipt(key) for key in matches])
+        for receipt in receipts:
+            key = self.key_for(receipt["transactionHash"])
+            if key in waiting:
+                self.included[key] = receipt
+
+    async def check_single(self, key):
+        try:
+            self.included[key] = await self.w3.eth.get_transaction_receipt(key)
+        except TransactionNotFound:
+            pass
+
+    def resolve_confirmed(self):
+        for key, receipt in list(self.included.items()):
+            if self.head - receipt["blockNumber"] + 1 >= self.confirmations:
+                del self.included[key]
+                # The future stays registered until its waiter collects it
+                future = self.pending.get(key)
+                if future and not future.done():
+                    future.set_result(receipt)
+
+
+class FeeOracle:
+    # Prices transactions once per block. On EIP-1559 chains the tip is a percentile of recent
+    # eth_feeHistory rewards and maxFeePerGas leaves headroom for base fee growth; chains without
+    # a base fee fall back to eth_gasPrice.
+    def __init__(self, w3, receipts, policy="normal", history_blocks=10, ttl=1.0):
+        self.w3 = w3
+        self.receipts = receipts
+        self.policy = policy
+        self.history_blocks = history_blocks
+        self.ttl = ttl
+        self.cached = None
+        self.cached_block = None
+        self.cached_at = 0
+        self.refreshing = None
+
+    def is_fresh(self):
+        if self.cached is None:
+            return False
+        watcher_active = self.receipts.task is not None and not self.receipts.task.done() and self.receipts.head is not None
+        if watcher_active and self.cached_block is not None:
+            return self.cached_block >= self.receipts.head
+        return time.monotonic() - self.cached_at < self.ttl
+
+    async def fees(self, policy=None):
+        policy = policy or self.policy
+        if policy not in FEE_POLICIES:
+            raise ValueError(f"Unknown fee policy: {policy}")
+        if not self.is_fresh():
+            # Concurrent callers share a single refresh
+            if self.refreshing is None:
+                self.refreshing = asyncio.ensure_future(self.refresh())
+            refreshing = self.refreshing
+            try:
+                await refreshing
+            finally:
+                if self.refreshing is refreshing:
+                    self.refreshing = None
+        return dict(self.cached[policy])
+
+    async def refresh(self):
+        percentiles = [FEE_POLICIES[name]["percentile"] for name in FEE_POLICIES]
+        quotes = None
+        block = None
+        try:
+            history = await self.w3.eth.fee_history(self.history_blocks, "latest", percentiles)
+            base_fees = history.get("baseFeePerGas") or []
+            rewards = history.get("reward") or []
+            if base_fees and base_fees[-1] > 0 and rewards:
+                block = history["oldestBlock"] + len(rewards) - 1
+                next_base_fee = base_fees[-1]
+                quotes = {}
+                for i, (name, policy) in enumerate(FEE_POLICIES.items()):
+                    tips = sorted(reward[i] for reward in rewards if len(reward) > i)
+                    tip = max(tips[len(tips) // 2] if tips else 0, MIN_PRIORITY_FEE)
+                    quotes[name] = {
+                        "maxPriorityFeePerGas": tip,
+                        "maxFeePerGas": int(next_base_fee * policy["base_fee_multiplier"]) + tip
+                    }
+        except Exception as e:
+            log.warn(f"Fee history unavailable, using legacy gas price: {e}")
+        if quotes is None:
+            gas_price = await self.w3.eth.gas_price
+            quotes = {name: {"gasPrice": int(gas_price * policy["legacy_multiplier"])} for name, policy in FEE_POLICIES.items()}
+        self.cached = quotes
+        self.cached_block = block
+        self.cached_at = time.monotonic()
+
+
+class FeeBumper:
+    # Replaces transactions that stay pending. A waiter whose transaction is still unmined after
+    # `stuck_blocks` blocks re-signs it on the same nonce. The new fees are the old ones plus
+    # FEE_BUMP_BPS, or the current "fast" quote if that is higher, and never more than FEE_BUMP_CAP
+    # times the original fees. Each hash in the replacement chain stays tracked, and the waiter
+    # gets the receipt of whichever one is mined. Blocks are counted from the broadcast, or from
+    # when the account's previous nonce was mined, since nothing can include a transaction before that.
+    def __init__(self, w3, receipts, fee_oracle, journal, metrics, stuck_blocks=STUCK_AFTER_BLOCKS):
+        self.w3 = w3
+        self.receipts = receipts
+        self.fee_oracle = fee_oracle
+        self.journal = journal
+        self.metrics = metrics
+        self.stuck_blocks = stuck_blocks
+        self.chains = {}
+
+    def register(self, account, tx, tx_hash, block):
+        # `block` is the chain head read at broadcast, since the watcher's own head is stale after it
+        # idles; None leaves the count to start at the first head `wait` sees
+        fees = {field: tx[field] for field in FEE_FIELDS if field in tx}
+        self.chains[self.receipts.key_for(tx_hash)] = {
+            "account": account, "tx": dict(tx), "hashes": [tx_hash], "since": block,
+            "cap": {field: value * FEE_BUMP_CAP for field, value in fees.items()}, "capped": False
+        }
+
+    def latest(self, tx_hash):
+        chain = self.chains.get(self.receipts.key_for(tx_hash))
+        return chain["hashes"][-1] if chain else tx_hash
+
+    def behind(self, chain):
+        # Chains of the same account on a lower nonce that are not mined yet. The watcher follows a
+        # chain even when nobody waits on it (an action that returned early), so its futures tell
+        # whether it is still pending; a settled one is dropped so it never holds later nonces back.
+        lower = []
+        for key, other in list(self.chains.items()):
+            if other["account"].address != chain["account"].address or other["tx"]["nonce"] >= chain["tx"]["nonce"]:
+                continue
+            futures = [self.receipts.pending.get(self.receipts.key_for(replaced)) for replaced in other["hashes"]]
+            if any(future is not None and not future.done() for future in futures):
+                lower.append(other)
+            else:
+                del self.chains[key]
+        return lower
+
+    def forget(self, tx_hash):
+        chain = self.chains.pop(self.receipts.key_for(tx_hash), None)
+        for replaced in chain["hashes"] if chain else [tx_hash]:
+            self.receipts.untrack(replaced)
+
+    async def wait(self, tx_hash, timeout=None):
+        key = self.receipts.key_for(tx_hash)
+        chain = self.chains.get(key)
+        if chain is None:
+            return await self.receipts.wait(tx_hash, timeout)
+        deadline = time.monotonic() + (timeout or self.receipts.timeout)
+        while True:
+            futures = {self.receipts.track(replaced): replaced for replaced in chain["hashes"]}
+            remaining = deadline - time.monotonic()
+            done, _ = await asyncio.wait(futures, timeout=max(min(self.receipts.poll_interval, remaining), 0), return_when=asyncio.FIRST_COMPLETED)
+            mined = [future for future in done if not future.cancelled()]
+            if mined:
+                # The other hashes share the mined one's nonce, so none of them can land any more
+                self.chains.pop(key, None)
+                for future, replaced in futures.items():
+                    self.receipts.pending.pop(self.receipts.key_for(replaced), None)
+                    if future is not mined[0]:
+                        future.cancel()
+                receipt = mined[0].result()
+                for other in self.chains.values():
+                    if other["account"].address == chain["account"].address and other["tx"]["nonce"] > chain["tx"]["nonce"]:
+                        other["since"] = max(other["since"] or 0, receipt["blockNumber"])
+                return receipt
+            if remaining <= 0:
+                raise TimeExhausted(f"Transaction {key} is not in the chain after {timeout or self.receipts.timeout} seconds")
+            head = self.receipts.head
+            if chain["since"] is None:
+                chain["since"] = head
+            elif head is not None and head - chain["since"] >= self.stuck_blocks and not chain["capped"]:
+                if self.behind(chain):
+                    # Waiting on an earlier nonce, not stuck; count again once that one is mined
+                    chain["since"] = head
+                else:
+                    try:
+                        await self.replace(chain)
+                    except Exception as e:
+                        # The original is still pending, so keep waiting and try again on a later pass
+                        log.warn(f"Could not replace stuck transaction {self.w3.to_hex(chain['hashes'][-1])}: {e}")
+
+    async def replace(self, chain):
+        tx = chain["tx"]
+        previous = self.w3.to_hex(chain["hashes"][-1])
+        market, block = await asyncio.gather(self.fee_oracle.fees("fast"), self.w3.eth.block_number)
+        fees = {}
+        for field, cap in chain["cap"].items():
+            minimum = tx[field] + max(-(-tx[field] * FEE_BUMP_BPS // 10000), 1)
+            if minimum > cap:
+                chain["capped"] = True
+                log.warn(f"Transaction {previous} is stuck but its fees are at the cap of {FEE_BUMP_CAP}x, waiting")
+                return
+            fees[field] = min(max(minimum, market.get(field, 0)), cap)
+        if "maxFeePerGas" in fees:
+            fees["maxFeePerGas"] = max(fees["maxFeePerGas"], fees["maxPriorityFeePerGas"])
+        tx = dict(tx, **fees)
+        chain["since"] = block
+        with self.metrics.span("replace"):
+            signed_tx = self.w3.eth.account.sign_transaction(tx, private_key=chain["account"].key)
+            tx_hash = self.w3.to_hex(signed_tx.hash)
+            self.journal.record("signed", hash=tx_hash, account=chain["account"].address, nonce=tx["nonce"], replaces=previous)
+            self.receipts.track(signed_tx.hash)
+            try:
+                await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            except Exception as e:
+                message = str(e).lower()
+                if "already known" not in message:
+                    self.journal.record("rejected", hash=tx_hash, error=str(e))
+                    self.receipts.untrack(signed_tx.hash)
+                    if "nonce too low" in message:
+                        # An earlier hash of the chain was just mined; the watcher will report it
+                        return
+                    if "underpriced" in message:
+                        # The node wants a larger step; start the next attempt from these fees
+                        chain["tx"] = tx
+                    log.warn(f"Replacement for stuck transaction {previous} rejected: {e}")
+                    return
+        self.journal.record("broadcast", hash=tx_hash)
+        chain["tx"] = tx
+        chain["hashes"].append(signed_tx.hash)
+        log.warn(f"Transaction {previous} stuck for {self.stuck_blocks} blocks, replaced by {tx_hash}", **fees)
+
+
+class PoolStateCache:
+    # Price, liquidity and fee of the Algebra pool behind every token pair, read together in one
+    # multicall at most once per block; pool addresses come from the router's factory once per session.
+    # `quote` then prices any number of candidate swaps from that state with no further RPC calls.
+    def __init__(self, w3, reader, receipts, router_address, tokens, native, wrapped, ttl=1.0):
+        self.w3 = w3
+        self.reader = reader
+        self.receipts = receipts
+        self.router_address = router_address
+        self.tokens = tokens
+        self.native = native.lower()
+        self.wrapped = wrapped.lower()
+        self.ttl = ttl
+        self.pools = None
+        self.states = {}
+        self.block = None
+        self.read_at = 0
+        self.refreshing = None
+
+    def resolve(self, token):
+        # Native cBTC trades through the wrapped token's pools
+        return self.wrapped if token.lower() == self.native else token.lower()
+
+    def pair(self, token_a, token_b):
+        # Algebra orders a pool's tokens by address
+        return tuple(sorted((self.resolve(token_a), self.resolve(token_b))))
+
+    def is_fresh(self):
+        if self.pools is None:
+            # Until the pools are found, a failed discovery is retried at most once per ttl
+            return time.monotonic() - self.read_at < self.ttl
+        watcher_active = self.receipts.task is not None and not self.receipts.task.done() and self.receipts.head is not None
+        if watcher_active and self.block is not None:
+            return self.block >= self.receipts.head
+        return time.monotonic() - self.read_at < self.ttl
+
+    async def update(self):
+        # Quotes are an optimisation, so a failed read only leaves the previous state in place
+        if self.is_fresh():
+            return
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self.refresh())
+        refreshing = self.refreshing
+        try:
+            await refreshing
+        except Exception as e:
+            self.read_at = time.monotonic()
+            log.warn(f"Pool state unavailable, quoting disabled for now: {e}")
+        finally:
+            if self.refreshing is refreshing:
+                self.refreshing = None
+
+    async def refresh(self):
+        if self.pools is None:
+            await self.discover()
+        pools = list(self.pools.items())
+        calls = [ReadCall(self.reader.address, "getBlockNumber()", [], ["uint256"])]
+        for _, pool in pools:
+            # Algebra V1 and Integral both start globalState with (price, tick, fee)
+            calls.append(ReadCall(pool, "globalState()", [], ["uint160", "int24", "uint16"]))
+            calls.append(ReadCall(pool, "liquidity()", [], ["uint128"]))
+        results = await self.reader.read(calls)
+        states = {}
+        for i, (pair, pool) in enumerate(pools):
+            state, liquidity = results[1 + 2 * i], results[2 + 2 * i]
+            if state and liquidity:
+                states[pair] = {"sqrt_price": state[0], "fee": state[2], "liquidity": liquidity}
+        self.states, self.block, self.read_at = states, results[0], time.monotonic()
+
+    async def discover(self):
+        (factory,) = await self.reader.read([ReadCall(self.router_address, "factory()", [], ["address"])])
+        if not factory:
+            raise Exception("could not read the router's factory")
+        pairs = list(dict.fromkeys(self.pair(a, b) for a, b in itertools.combinations(self.tokens, 2)))
+        found = await self.reader.read([
+            ReadCall(Web3.to_checksum_address(factory), "poolByPair(address,address)", [Web3.to_checksum_address(a), Web3.to_checksum_address(b)], ["address"])
+            for a, b in pairs
+        ])
+        self.pools = {pair: Web3.to_checksum_address(pool) for pair, pool in zip(pairs, found) if pool and int(pool, 16) != 0}
+        log.info(f"Found {len(self.pools)} pool(s) for {len(pairs)} token pair(s)")
+
+    def quote(self, token_in, token_out, amounts):
+        # Expected output in wei for each input amount in wei, assuming the swap stays inside the current
+        # liquidity range. None where there is no pool, or where the price would move more than
+        # QUOTE_MAX_IMPACT_BPS, since crossing ticks the cache does not hold makes the estimate unsafe.
+        state = self.states.get(self.pair(token_in, token_out))
+        if state is None:
+            return [None] * len(amounts)
+        zero_for_one = self.resolve(token_in) < self.resolve(token_out)
+        price, liquidity, fee = state["sqrt_price"], state["liquidity"], state["fee"]
+        quotes = []
+        for amount in amounts:
+            if not amount:
+                quotes.append(None)
+                continue
+            amount_less_fee = amount * (1000000 - fee) // 1000000
+            if zero_for_one:
+                new_price = -(-liquidity * price * Q96 // (liquidity * Q96 + amount_less_fee * price))
+                amount_out = liquidity * (price - new_price) // Q96
+            else:
+                new_price = price + amount_less_fee * Q96 // liquidity
+                amount_out = liquidity * Q96 * (new_price - price) // (new_price * price)
+            impact = abs(new_price * new_price - price * price) * 10000 // (price * price)
+            quotes.append(amount_out if impact <= QUOTE_MAX_IMPACT_BPS else None)
+        return quotes
+
+    def quote_route(self, route, amounts):
+        for token_in, token_out in zip(route, route[1:]):
+            amounts = self.quote(token_in, token_out, amounts)
+        return amounts
+
+
+class GasProfiles:
+    # Learns gas limits per (contract, function, token pair) from the gasUsed of our own receipts.
+    # The first use of a key runs estimate_gas; afterwards a percentile of recorded usage plus a
+    # safety margin is used without any round trip.
+    def __init__(self, w3, path=GAS_PROFILE_FILE):
+        self.w3 = w3
+        self.path = path
+        self.samples = load_json_file(path, {}, "gas profiles")
+        self.estimates = {}
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    def save(self):
+        if self.dirty and save_json_file(self.path, self.samples, "gas profiles"):
+            self.dirty = False
+            self.saved_at = time.monotonic()
+
+    @staticmethod
+    def key_for(to, data, *tokens):
+        selector = data[:10] if isinstance(data, str) else Web3.to_hex(data)[:10]
+        return ":".join([to.lower(), selector] + [t.lower() for t in tokens])
+
+    def learned_limit(self, key):
+        samples = sorted(self.samples.get(key, []))
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * GAS_PROFILE_PERCENTILE / 100))
+        return int(samples[index] * GAS_PROFILE_MARGIN)
+
+    async def gas_limit(self, tx, key, default_gas, can_estimate=True):
+        learned = self.learned_limit(key)
+        if learned:
+            return learned
+        if key in self.estimates:
+            return self.estimates[key]
+        if not can_estimate:
+            # e.g. the approval this transaction depends on is not mined yet, so estimation would revert
+            return default_gas
+        try:
+            call = {k: tx[k] for k in ("from", "to", "data", "value") if k in tx}
+            estimated = int(await self.w3.eth.estimate_gas(call) * GAS_PROFILE_MARGIN)
+            self.estimates[key] = estimated
+            return estimated
+        except Exception as e:
+            log.warn(f"Gas estimation failed, using default limit {default_gas}: {e}")
+            return default_gas
+
+    def record(self, key, gas_used):
+        samples = self.samples.setdefault(key, [])
+        samples.append(gas_used)
+        del samples[:-GAS_PROFILE_SAMPLES]
+        self.estimates.pop(key, None)
+        self.dirty = True
+        if time.monotonic() - self.saved_at > GAS_PROFILE_SAVE_INTERVAL:
+            self.save()
+
+
+class AllowanceIndex:
+    # Persisted view of our allowances keyed by (owner, token, spender). It is fed from the Approval
+    # logs of our own receipts and debited as swaps spend it, so steady-state swaps skip the live read.
+    def __init__(self, path=ALLOWANCE_INDEX_FILE):
+        self.path = path
+        self.values = load_json_file(path, {}, "allowance index")
+        self.dirty = False
+        self.saved_at = time.monotonic()
+
+    @staticmethod
+    def key_for(owner, token, spender):
+        return f"{owner.lower()}:{token.lower()}:{spender.lower()}"
+
+    def get(self, owner, token, spender):
+        value = self.values.get(self.key_for(owner, token, spender))
+        return int(value) if value is not None else None
+
+    def set(self, owner, token, spender, value):
+        # Stored as strings since a max approval does not fit in a JSON number for most readers
+        self.values[self.key_for(owner, token, spender)] = str(value)
+        self.changed()
+
+    def spend(self, owner, token, spender, amount):
+        value = self.get(owner, token, spender)
+        if value is None or value == MAX_UINT256:
+            return
+        self.set(owner, token, spender, max(0, value - amount))
+
+    def forget(self, owner, token, spender):
+        if self.values.pop(self.key_for(owner, token, spender), None) is not None:
+            self.changed()
+
+    def apply_receipt(self, receipt):
+        applied = False
+        for entry in receipt["logs"]:
+            topics = entry["topics"]
+            if len(topics) != 3 or bytes(topics[0]) != APPROVAL_TOPIC:
+                continue
+            owner = Web3.to_checksum_address(bytes(topics[1])[-20:])
+            spender = Web3.to_checksum_address(bytes(topics[2])[-20:])
+            self.set(owner, entry["address"], spender, int.from_bytes(bytes(entry["data"]), "big"))
+            applied = True
+        return applied
+
+    def changed(self):
+        self.dirty = True
+        if time.monotonic() - self.saved_at > ALLOWANCE_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.dirty and save_json_file(self.path, self.values, "allowance index"):
+            self.dirty = False
+            self.saved_at = time.monotonic()
+
+
+class TransactionJournal:
+    # Append-only JSONL log of each transaction's lifecycle (intent -> signed -> broadcast -> mined)
+    # and of automated-run progress. Recording only buffers a line; a background task appends and
+    # fsyncs everything buffered together, so durability costs one fsync per flush, not per event.
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.buffer = []
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.pending = {}
+        self.run = None
+        self.replay()
+
+    def replay(self):
+        # Rebuild which transactions were sent but never seen mined, and how far the last run got
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        self.apply(json.loads(line))
+                    except ValueError:
+                        continue  # a line torn by a crash mid-write
+        except OSError as e:
+            log.warn(f"Failed to replay transaction journal: {e}")
+            return
+        self.compact()
+
+    def apply(self, entry):
+        event = entry["event"]
+        if event in ("signed", "broadcast"):
+            self.pending[entry["hash"]] = dict(self.pending.get(entry["hash"], {}), **entry)
+        elif event == "rejected":
+            self.pending.pop(entry["hash"], None)
+        elif event in ("mined", "dropped"):
+            # Fee-bump replacements share the nonce, so once one is settled the rest of its chain is too
+            settled = self.pending.pop(entry["hash"], None)
+            if settled:
+                for tx_hash, other in list(self.pending.items()):
+                    if other.get("account") == settled.get("account") and other.get("nonce") == settled.get("nonce"):
+                        del self.pending[tx_hash]
+        elif event == "run":
+            self.run = {"total": entry["total"], "done": entry.get("done", 0)}
+        elif event == "progress" and self.run:
+            self.run["done"] += 1
+        elif event == "run_end":
+            self.run = None
+
+    def compact(self):
+        # Rewrite the journal as just the surviving state so it does not grow across sessions
+        entries = list(self.pending.values())
+        if self.run:
+            entries.append({"event": "run", "time": time.time(), **self.run})
+        try:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in entries)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warn(f"Failed to compact transaction journal: {e}")
+
+    def record(self, event, **fields):
+        entry = {"event": event, "time": time.time(), **fields}
+        self.apply(entry)
+        self.buffer.append(json.dumps(entry) + "\n")
+        self.wakeup.set()
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.flusher())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.write(self.take())
+
+    def take(self):
+        lines, self.buffer = self.buffer, []
+        self.wakeup.clear()
+        return lines
+
+    def write(self, lines):
+        if not lines:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError as e:
+            log.warn(f"Failed to write transaction journal: {e}")
+
+    async def flusher(self):
+        while True:
+            await self.wakeup.wait()
+            # Let events from concurrent transactions pile up so they share one fsync
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            await asyncio.to_thread(self.write, self.take())
+
+
+class EventIndexer:
+    # Local SQLite copy of the logs that involve our wallets: token transfers and approvals, WCBTC
+    # wraps and unwraps, veSUMA locks and exits. `sync` pulls new blocks with eth_getLogs in ranges
+    # that halve when the node refuses a request and double again while responses stay small. Each
+    # range's events and checkpoints commit in one transaction, so an interrupted sync just resumes.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS events (
+            tx_hash TEXT NOT NULL,
+            log_index INTEGER NOT NULL,
+            account TEXT NOT NULL,
+            block INTEGER NOT NULL,
+            contract TEXT NOT NULL,
+            event TEXT NOT NULL,
+            counterparty TEXT,
+            amount TEXT NOT NULL,
+            delta REAL NOT NULL,
+            PRIMARY KEY (tx_hash, log_index, account)
+        );
+        CREATE INDEX IF NOT EXISTS events_account_block ON events (account, block);
+        CREATE INDEX IF NOT EXISTS events_contract_event ON events (contract, event);
+        CREATE TABLE IF NOT EXISTS checkpoints (account TEXT PRIMARY KEY, block INTEGER NOT NULL);
+    """
+
+    def __init__(self, path=INDEX_DB_FILE):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+        self.chunk = INDEX_CHUNK_BLOCKS
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def topic_for(address):
+        return "0x" + "00" * 12 + address.lower()[2:]
+
+    async def sync(self, w3, accounts, contracts, decimals, head):
+        # `decimals` maps lowercase contract address to token decimals; `delta` is stored in token units
+        accounts = [account.lower() for account in accounts]
+        saved = dict(self.db.execute("SELECT account, block FROM checkpoints"))
+        fresh = max(0, head - INDEX_LOOKBACK_BLOCKS) - 1
+        # Accounts already further along get their overlap again; the primary key drops duplicates
+        block = min(saved.get(account, fresh) for account in accounts) + 1
+        wallets = [self.topic_for(account) for account in accounts]
+        added = 0
+        while block <= head:
+            end = min(head, block + self.chunk - 1)
+            try:
+                logs = await self.fetch(w3, contracts, wallets, block, end)
+            except Exception as e:
+                if end > block and any(text in str(e).lower() for text in INDEX_RANGE_ERRORS):
+                    self.chunk = max(INDEX_CHUNK_LIMITS[0], (end - block + 1) // 2)
+                    log.warn(f"eth_getLogs refused blocks {block}-{end}, retrying with {self.chunk}-block ranges")
+                    continue
+                raise
+            with self.db:
+                added += self.store(logs, set(accounts), decimals)
+                self.db.executemany(
+                    "INSERT INTO checkpoints VALUES (?, ?) ON CONFLICT(account) DO UPDATE SET block = MAX(block, excluded.block)",
+                    [(account, end) for account in accounts]
+                )
+            block = end + 1
+            if len(logs) < INDEX_GROW_BELOW:
+                self.chunk = min(INDEX_CHUNK_LIMITS[1], self.chunk * 2)
+        return added
+
+    async def fetch(self, w3, contracts, wallets, start, end):
+        # Two filters cover everything: events whose first indexed address is one of our wallets,
+        # and transfers whose recipient is. Both go out in the same JSON-RPC batch.
+        base = {"fromBlock": start, "toBlock": end, "address": contracts}
+        sent, received = await asyncio.gather(
+            w3.eth.get_logs(dict(base, topics=[[Web3.to_hex(topic) for topic in INDEXED_EVENTS], wallets])),
+            w3.eth.get_logs(dict(base, topics=[Web3.to_hex(TRANSFER_TOPIC), None, wallets]))
+        )
+        return list(sent) + list(received)
+
+    def store(self, logs, accounts, decimals):
+        rows = []
+        for entry in logs:
+            topics = [bytes(topic) for topic in entry["topics"]]
+            event = INDEXED_EVENTS.get(topics[0]) if topics else None
+            # ERC-20 transfers and approvals carry both addresses as topics; NFT-style ones have a third
+            if event is None or (event in ("transfer", "approval") and len(topics) != 3):
+                continue
+            contract = entry["address"].lower()
+            amount = int.from_bytes(bytes(entry["data"])[:32], "big")
+            units = amount / 10 ** decimals.get(contract, 18)
+            first = "0x" + topics[1][-20:].hex()
+            second = "0x" + topics[2][-20:].hex() if len(topics) > 2 else None
+            if event == "transfer":
+                parties = [(first, second, -units), (second, first, units)]
+            elif event == "approval":
+                parties = [(first, second, 0.0)]
+            elif event in ("wrap", "unwrap"):
+                # WCBTC emits no Transfer when wrapping, so these are its balance changes
+                parties = [(first, None, units if event == "wrap" else -units)]
+            else:
+                # The SUMA that moves into or out of the lock is already recorded as a transfer
+                parties = [(first, None, 0.0)]
+            tx_hash = Web3.to_hex(entry["transactionHash"])
+            for account, counterparty, delta in parties:
+                if account in accounts:
+                    rows.append((tx_hash, entry["logIndex"], account, entry["blockNumber"], contract, event, counterparty, str(amount), delta))
+        before = self.db.total_changes
+        self.db.executemany("INSERT OR IGNORE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return self.db.total_changes - before
+
+    def checkpoint(self):
+        row = self.db.execute("SELECT MIN(block) FROM checkpoints").fetchone()
+        return row[0]
+
+    def history(self, limit):
+        # The latest `limit` (transaction, wallet) pairs across all wallets, newest first, each with all of its rows
+        recent = self.db.execute(
+            "SELECT tx_hash, account FROM events GROUP BY tx_hash, account ORDER BY MAX(block) DESC, tx_hash LIMIT ?", (limit,)
+        ).fetchall()
+        grouped = {key: [] for key in recent}
+        if recent:
+            placeholders = ", ".join("?" * len(recent))
+            for row in self.db.execute(
+                f"SELECT tx_hash, account, block, contract, event, counterparty, delta FROM events WHERE tx_hash IN ({placeholders}) ORDER BY log_index",
+                [tx_hash for tx_hash, _ in recent]
+            ):
+                if (row[0], row[1]) in grouped:
+                    grouped[(row[0], row[1])].append(row)
+        return [(tx_hash, account, rows[0][2], self.classify(rows), rows) for (tx_hash, account), rows in grouped.items() if rows]
+
+    @staticmethod
+    def classify(rows):
+        events = {row[4] for row in rows}
+        spent = {row[3] for row in rows if row[4] == "transfer" and row[6] < 0}
+        received = {row[3] for row in rows if row[4] == "transfer" and row[6] > 0}
+        for event, label in (("lock", "lock"), ("unlock", "exit"), ("wrap", "wrap"), ("unwrap", "unwrap")):
+            if event in events:
+                return label
+        if len(spent) >= 2 and received:
+            return "add_liquidity"
+        if spent and received:
+            return "swap"
+        if spent or received:
+            return "transfer"
+        return "approve"
+
+    def net_flows(self):
+        # Net token flow per wallet over everything indexed, in token units
+        return self.db.execute(
+            "SELECT account, contract, SUM(CASE WHEN delta > 0 THEN delta ELSE 0 END), SUM(CASE WHEN delta < 0 THEN -delta ELSE 0 END), SUM(delta), COUNT(DISTINCT tx_hash) "
+            "FROM events WHERE event != 'approval' GROUP BY account, contract ORDER BY account, contract"
+        ).fetchall()
+
+
+class ExecutionEngine:
+    # One ordered queue per account plus a global cap on actions in flight. Different accounts
+    # progress in parallel while each account's actions, and therefore its nonces, stay in order.
+    def __init__(self, concurrency):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.queues = {}
+        self.workers = {}
+
+    def submit(self, account_key, job, delay=0):
+        # `job` is a zero-argument coroutine function; `delay` is a pause after it that does not hold a slot
+        future = asyncio.get_running_loop().create_future()
+        if account_key not in self.queues:
+            self.queues[account_key] = asyncio.Queue()
+            self.workers[account_key] = asyncio.create_task(self.worker(self.queues[account_key]))
+        self.queues[account_key].put_nowait((job, delay, future))
+        return future
+
+    async def worker(self, queue):
+        while True:
+            job, delay, future = await queue.get()
+            try:
+                async with self.semaphore:
+                    with log.scope():
+                        result = await job()
+                if not future.done():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
+            if delay:
+                await asyncio.sleep(delay)
+
+    async def stop(self):
+        for task in self.workers.values():
+            task.cancel()
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+        self.queues.clear()
+        self.workers.clear()
+
+
+class PlanRunner:
+    # Runs a plan of actions without prompts. A step starts once every step in its `after` list
+    # has succeeded and then goes through the execution engine, so independent steps overlap
+    # while each account's steps keep their nonce order.
+    def __init__(self, bot, plan, on_status=None):
+        # `on_status(step_id, status, record)` hears each step become queued, running and then finished
+        self.bot = bot
+        self.on_status = on_status
+        self.steps = self.validate(plan)
+
+    def notify(self, step, status, record=None):
+        if self.on_status:
+            self.on_status(step["id"], status, record)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'r') as f:
+            if not path.endswith((".yaml", ".yml")):
+                return json.load(f)
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML plans need PyYAML (pip install pyyaml); use JSON otherwise")
+            try:
+                return yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(str(e))
+
+    def token(self, name):
+        # Token names match case-insensitively, so "cbtc" and "vesuma" work as well
+        for symbol, address in self.bot.token_addresses.items():
+            if symbol.lower() == str(name).lower():
+                return address
+        raise ValueError(f"unknown token {name!r}")
+
+    def validate(self, plan):
+        raw_steps = plan.get("steps") if isinstance(plan, dict) else plan
+        if not isinstance(raw_steps, list) or not raw_steps:
+            raise ValueError("a plan needs a non-empty list of steps")
+        steps, ids = [], set()
+        for n, raw in enumerate(raw_steps, start=1):
+            if not isinstance(raw, dict):
+                raise ValueError(f"step {n} is not a mapping")
+            step_id = str(raw.get("id", f"step{n}"))
+            action = raw.get("action")
+            where = f"step {step_id!r}"
+            if step_id in ids:
+                raise ValueError(f"{where} is defined twice")
+            if action not in PLAN_ACTIONS:
+                raise ValueError(f"{where} has unknown action {action!r}; expected one of {', '.join(PLAN_ACTIONS)}")
+            missing = [name for name in PLAN_ACTIONS[action] if name not in raw]
+            if missing:
+                raise ValueError(f"{where} is missing {', '.join(missing)}")
+            account = raw.get("account", 0)
+            if not isinstance(account, int) or not 0 <= account < self.bot.wallet_count():
+                raise ValueError(f"{where} uses account {account!r}, but {self.bot.wallet_count()} wallet(s) are loaded")
+            params = {name: raw[name] for name in PLAN_ACTIONS[action]}
+            try:
+                after = raw.get("after", [])
+                after = [after] if isinstance(after, str) else after
+                if not isinstance(after, list) or not all(isinstance(dep, str) for dep in after):
+                    raise ValueError("after must be a step id or a list of step ids")
+                if action == "swap":
+                    route = params["route"].split(">") if isinstance(params["route"], str) else params["route"]
+                    if not isinstance(route, list):
+                        raise ValueError("a swap route is a list of tokens or a string like \"USDC>SUMA\"")
+                    params["route"] = [self.token(str(name).strip()) for name in route]
+                    if len(params["route"]) < 2:
+                        raise ValueError("a swap route needs at least two tokens")
+                    if any(a == b for a, b in zip(params["route"], params["route"][1:])):
+                        raise ValueError("a swap route cannot repeat a token in adjacent positions")
+                elif action == "add_liquidity":
+                    params["token_a"], params["token_b"] = self.token(params["token_a"]), self.token(params["token_b"])
+                for name in ("amount", "amount_a", "amount_b"):
+                    if name in params and not float(params[name]) > 0:
+                        raise ValueError(f"{name} must be positive")
+                if "lock_days" in params and not int(params["lock_days"]) > 0:
+                    raise ValueError("lock_days must be positive")
+                if "weight" in params and not 0 <= int(params["weight"]) <= 100:
+                    raise ValueError("weight must be between 0 and 100")
+                if "gauge" in params:
+                    from eth_utils import is_address  # web3 itself is not loaded before connecting
+                    if not is_address(str(params["gauge"])):
+                        raise ValueError(f"gauge {params['gauge']!r} is not an address")
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"{where}: {e}")
+            ids.add(step_id)
+            steps.append({"id": step_id, "action": action, "account": account, "after": after, "params": params})
+        return self.order(steps)
+
+    def order(self, steps):
+        # Topological order, so every step comes after the steps it depends on; a cycle is an error
+        by_id = {step["id"]: step for step in steps}
+        for step in steps:
+            unknown = [dep for dep in step["after"] if dep not in by_id]
+            if unknown:
+                raise ValueError(f"step {step['id']!r} depends on unknown step(s) {', '.join(unknown)}")
+        ordered, placed = [], set()
+        while len(ordered) < len(steps):
+            ready = [step for step in steps if step["id"] not in placed and all(dep in placed for dep in step["after"])]
+            if not ready:
+                cycle = [step["id"] for step in steps if step["id"] not in placed]
+                raise ValueError(f"steps {', '.join(cycle)} are part of or wait on a dependency cycle")
+            ordered.extend(ready)
+            placed.update(step["id"] for step in ready)
+        return ordered
+
+    async def execute(self, step):
+        bot, params = self.bot, step["params"]
+        log.bind(step=step["id"])
+        self.notify(step, "running")
+        private_key = bot.private_keys[step["account"]]
+        action = step["action"]
+        if action == "balances":
+            symbols = list(bot.token_addresses)
+            balances = await bot.get_token_balances([bot.token_addresses[symbol] for symbol in symbols], bot.get_account(private_key).address)
+            return {"success": all(balances), "balances": {symbol: info["formatted"] if info else None for symbol, info in zip(symbols, balances)}}
+        if action == "swap":
+            route, amount = params["route"], float(params["amount"])
+            if len(route) > 2:
+                return await bot.perform_swap_route(private_key, route, amount)
+            return await bot.perform_swap(private_key, route[0], route[1], amount)
+        if action == "add_liquidity":
+            return await bot.add_liquidity(private_key, params["token_a"], params["token_b"], float(params["amount_a"]), float(params["amount_b"]))
+        if action == "convert_to_vesuma":
+            return await bot.convert_to_vesuma(private_key, float(params["amount"]), int(params["lock_days"]))
+        if action == "convert_vesuma_to_suma":
+            return await bot.convert_vesuma_to_suma(private_key)
+        if action == "stake_vesuma":
+            return await bot.stake_vesuma(private_key, float(params["amount"]))
+        return await bot.vote_with_vesuma(private_key, Web3.to_checksum_address(params["gauge"]), int(params["weight"]))
+
+    async def run_step(self, step, dependencies):
+        record = {"id": step["id"], "action": step["action"], "account": self.bot.get_account(self.bot.private_keys[step["account"]]).address, "after": step["after"]}
+        failed = [dep["id"] for dep in await asyncio.gather(*dependencies) if dep["status"] != "succeeded"]
+        if failed:
+            log.warn(f"Skipping step {step['id']}: {', '.join(failed)} did not succeed")
+            record.update(status="skipped", error=f"dependency {', '.join(failed)} did not succeed")
+            self.notify(step, "skipped", record)
+            return record
+        log.step(f"Step {step['id']}: {step['action']}")
+        self.notify(step, "queued")
+        started = time.monotonic()
+        try:
+            result = await self.bot.engine.submit(self.bot.private_keys[step["account"]], lambda: self.execute(step))
+        except Exception as e:
+            result = {"success": False, "error": str(e)}
+        record.update(status="succeeded" if result["success"] else "failed", elapsed=round(time.monotonic() - started, 3))
+        record.update({key: value for key, value in result.items() if key != "success"})
+        self.notify(step, record["status"], record)
+        return record
+
+    async def run(self):
+        started = time.monotonic()
+        tasks = {}
+        for step in self.steps:
+            tasks[step["id"]] = asyncio.create_task(self.run_step(step, [tasks[dep] for dep in step["after"]]))
+        records = await asyncio.gather(*tasks.values())
+        report = {"elapsed": round(time.monotonic() - started, 3), "steps": records}
+        for status in ("succeeded", "failed", "skipped"):
+            report[status] = sum(1 for record in records if record["status"] == status)
+        log.info(f"Plan finished in {report['elapsed']:.1f}s: {report['succeeded']} succeeded, {report['failed']} failed, {report['skipped']} skipped")
+        return report
+
+
+class Daemon:
+    # Keeps one connected bot resident and takes jobs over a local HTTP API. Scripts skip the
+    # provider handshake, contract setup and cold caches that each `python bot.py` pays. A job is
+    # a plan step, and a submission may hold a whole plan. Each submission runs through PlanRunner,
+    # so it queues on the execution engine. Every status change goes out as a JSON line to /events
+    # and to submitters that asked for a stream.
+    #
+    #   POST /jobs[?stream=1]    a step or {"steps": [...]}; ids become "<submission>:<step id>"
+    #   GET  /jobs, /jobs/{id}[?wait=1], /status, /events
+    #   POST /shutdown           finish the jobs already taken, then exit
+    FINAL = ("succeeded", "failed", "skipped")
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.jobs = {}
+        self.tasks = set()
+        self.listeners = set()
+        self.submissions = itertools.count(1)
+        self.started = time.monotonic()
+        self.stopping = asyncio.Event()
+        self.runner = None
+
+    async def serve(self, socket_path=DAEMON_SOCKET, port=None):
+        app = web.Application()
+        app.router.add_get("/status", self.handle_status)
+        app.router.add_get("/jobs", self.handle_list)
+        app.router.add_post("/jobs", self.handle_submit)
+        app.router.add_get("/jobs/{id}", self.handle_job)
+        app.router.add_get("/events", self.handle_events)
+        app.router.add_post("/shutdown", self.handle_shutdown)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        if port:
+            await web.TCPSite(self.runner, METRICS_HOST, port).start()
+            where = f"http://{METRICS_HOST}:{port}"
+        else:
+            await web.UnixSite(self.runner, socket_path).start()
+            # Whoever can connect can spend from the wallets
+            os.chmod(socket_path, 0o600)
+            where = f"unix:{os.path.abspath(socket_path)}"
+        log.success(f"Daemon listening on {where}")
+
+    async def warm(self):
+        # Token metadata, pool state and nonces are loaded before the first job needs them
+        tokens = list(self.bot.token_addresses.values())
+        accounts = [self.bot.get_account(key) for key in self.bot.private_keys]
+        results = await asyncio.gather(
+            self.bot.pools.update(),
+            *[self.bot.get_token_balances(tokens, account.address) for account in accounts],
+            *[self.bot.nonces.sync(account.address) for account in accounts],
+            return_exceptions=True
+        )
+        failed = [result for result in results if isinstance(result, Exception)]
+        if failed:
+            log.warn(f"Cache warm-up incomplete: {failed[0]}")
+
+    async def run(self, socket_path=DAEMON_SOCKET, port=None):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        try:
+            await self.serve(socket_path, port)
+            await self.warm()
+            log.info(f"Ready for jobs: {len(self.bot.private_keys)} wallet(s), {', '.join(PLAN_ACTIONS)}")
+            await self.stopping.wait()
+        finally:
+            # A second Ctrl-C interrupts the drain below
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+        if self.tasks:
+            log.info(f"Daemon stopping, waiting for {len(self.tasks)} submission(s) to finish")
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        for queue in self.listeners:
+            queue.put_nowait(None)
+        await self.runner.cleanup()
+        if not port and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+    def submit(self, plan):
+        if isinstance(plan, dict) and "steps" not in plan:
+            plan = [plan]
+        runner = PlanRunner(self.bot, plan, on_status=self.update)
+        submission = next(self.submissions)
+        for step in runner.steps:
+            step["id"] = f"{submission}:{step['id']}"
+            step["after"] = [f"{submission}:{dep}" for dep in step["after"]]
+            account = self.bot.get_account(self.bot.private_keys[step["account"]]).address
+            self.jobs[step["id"]] = {"id": step["id"], "action": step["action"], "account": account, "status": "waiting", "submitted": time.time()}
+        task = asyncio.create_task(runner.run())
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        self.trim()
+        return [step["id"] for step in runner.steps]
+
+    def update(self, job_id, status, record=None):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        job.update(record or {}, status=status, updated=time.time())
+        for queue in self.listeners:
+            queue.put_nowait(dict(job))
+
+    def trim(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["status"] in self.FINAL]
+        for job_id in finished[:max(len(self.jobs) - DAEMON_JOB_HISTORY, 0)]:
+            del self.jobs[job_id]
+
+    @staticmethod
+    def reply(data, status=200):
+        return web.json_response(data, status=status, dumps=lambda value: json.dumps(value, default=str))
+
+    async def stream(self, request, job_ids=None):
+        # JSON lines: the current state of `job_ids`, then each change until they all finish;
+        # without `job_ids`, every change until the client or the daemon goes away
+        queue = asyncio.Queue()
+        self.listeners.add(queue)
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        try:
+            await response.prepare(request)
+            pending = set(job_ids or ())
+            for job_id in job_ids or ():
+                await response.write((json.dumps(self.jobs[job_id], default=str) + "\n").encode())
+                if self.jobs[job_id]["status"] in self.FINAL:
+                    pending.discard(job_id)
+            while pending or job_ids is None:
+                event = await queue.get()
+                if event is None:
+                    break
+                if job_ids is None or event["id"] in pending:
+                    await response.write((json.dumps(event, default=str) + "\n").encode())
+                    if event["status"] in self.FINAL:
+                        pending.discard(event["id"])
+            await response.write_eof()
+        except ConnectionResetError:
+            pass
+        finally:
+            self.listeners.discard(queue)
+        return response
+
+    async def handle_submit(self, request):
+        if self.stopping.is_set():
+            return self.reply({"error": "daemon is shutting down"}, 503)
+        try:
+            job_ids = self.submit(await request.json())
+        except ValueError as e:
+            return self.reply({"error": str(e)}, 400)
+        log.info(f"Accepted {len(job_ids)} job(s): {', '.join(job_ids)}")
+        if request.query.get("stream"):
+            return await self.stream(request, job_ids)
+        return self.reply({"jobs": [self.jobs[job_id] for job_id in job_ids]}, 202)
+
+    async def handle_job(self, request):
+        job_id = request.match_info["id"]
+        if job_id not in self.jobs:
+            return self.reply({"error": f"unknown job {job_id}"}, 404)
+        if request.query.get("wait"):
+            return await self.stream(request, [job_id])
+        return self.reply(self.jobs[job_id])
+
+    async def handle_list(self, request):
+        return self.reply({"jobs": list(self.jobs.values())})
+
+    async def handle_events(self, request):
+        return await self.stream(request)
+
+    async def handle_status(self, request):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return self.reply({
+            "uptime": round(time.monotonic() - self.started, 1), "wallets": len(self.bot.private_keys), "jobs": counts,
+            "pending_transactions": len(self.bot.journal.pending), "head": self.bot.receipts.head
+        })
+
+    async def handle_shutdown(self, request):
+        self.stopping.set()
+        return self.reply({"stopping": True, "submissions": len(self.tasks)})
 
 
 class SatsumaBot:
     def __init__(self):
+        # Only local state is set up here; web3 and the RPC connection come in `connect`
         self.config = self.load_config()
-        self.w3 = self.initialize_provider()
+        self.session = None
+        self.metrics = Metrics()
+        self.w3 = None
+        self.connecting = None
+        self.keystore_paths = self.find_keystores()
+        self.keystore_password = os.getenv("KEYSTORE_PASSWORD")
         self.private_keys = self.get_private_keys()
+        self.accounts = {}
         self.settings = self.load_user_settings()
-        self.transaction_history = []
+        self.journal = TransactionJournal()
+        self.index = None
+        self.resumed = []
         self.token_addresses = {
             "cBTC": "0x0000000000000000000000000000000000000000",
-            "USDC": Web3.to_checksum_address("0x2C8abD2A528D19AFc33d2eBA507c0F405c131335"),
-            "WCBTC": Web3.to_checksum_address("0x8d0c9d1c17ae5e40fff9be350f57840e9e66cd93"),
-            "SUMA": Web3.to_checksum_address("0xdE4251dd68e1aD5865b14Dd527E54018767Af58a"),
-            "veSUMA": Web3.to_checksum_address("0x97a4f684620D578312Dc9fFBc4b0EbD8E804ab4a")
+            "USDC": "0x2C8abD2A528D19AFc33d2ebA507c0F405c131335",
+            "WCBTC": "0x8d0c9d1c17aE5e40ffF9bE350f57840E9E66Cd93",
+            "SUMA": "0xdE4251dd68e1aD5865b14Dd527E54018767Af58a",
+            "veSUMA": "0x97a4f684620D578312Dc9fFBc4b0EbD8E804ab4a"
         }
-        self.contracts = {
-            "swap_router": self.w3.eth.contract(address=Web3.to_checksum_address("0x3012e9049d05b4b5369d690114d5a5861ebb85cb"), abi=SWAP_ROUTER_ABI),
-            "liquidity_router": self.w3.eth.contract(address=Web3.to_checksum_address("0x55a4669cd6895EA25C174F13E1b49d69B4481704"), abi=LIQUIDITY_ROUTER_ABI),
-            "vesuma": self.w3.eth.contract(address=self.token_addresses["veSUMA"], abi=VESUMA_ABI),
-            "staking": self.w3.eth.contract(address=Web3.to_checksum_address("0x1234567890123456789012345678901234567892"), abi=STAKING_VOTING_ABI),
-            "voting": self.w3.eth.contract(address=Web3.to_checksum_address("0x1234567890123456789012345678901234567891"), abi=STAKING_VOTING_ABI)
+        # Calldata is built with CalldataTemplate and reads go through Multicall3, so only addresses are needed
+        self.contract_addresses = {
+            "swap_router": "0x3012E9049d05B4B5369D690114D5A5861EbB85cb",
+            "liquidity_router": "0x55a4669cd6895EA25C174F13E1b49d69B4481704",
+            "vesuma": self.token_addresses["veSUMA"],
+            "staking": "0x1234567890123456789012345678901234567892",
+            "voting": "0x1234567890123456789012345678901234567891"
         }
+        self.token_metadata = {self.token_addresses["cBTC"]: {"decimals": 18, "symbol": "cBTC"}}
+
+    def setup_chain(self):
+        self.w3 = self.initialize_provider()
+        self.reader = MulticallReader(self.w3)
+        self.nonces = NonceManager(self.w3)
+        self.receipts = ReceiptWatcher(self.w3, self.config["block_poll_interval"], self.config["confirmations"], self.config["receipt_timeout"])
+        self.gas_profiles = GasProfiles(self.w3)
+        self.allowances = AllowanceIndex()
+        self.gas_keys = {}
+        self.engine = ExecutionEngine(self.settings["max_concurrency"])
+        self.fee_oracle = FeeOracle(self.w3, self.receipts, self.settings["fee_policy"], ttl=self.config["block_poll_interval"])
+        self.bumper = FeeBumper(self.w3, self.receipts, self.fee_oracle, self.journal, self.metrics, self.config["stuck_blocks"])
+        self.pools = PoolStateCache(
+            self.w3, self.reader, self.receipts, self.contract_addresses["swap_router"],
+            [address for symbol, address in self.token_addresses.items() if symbol != "cBTC"],
+            self.token_addresses["cBTC"], self.token_addresses["WCBTC"], ttl=self.config["block_poll_interval"]
+        )
+
+    def get_account(self, private_key):
+        # Deriving an account from a key is pure CPU work, so each one is derived once
+        account = self.accounts.get(private_key)
+        if account is None:
+            account = self.w3.eth.account.from_key(private_key)
+            self.accounts[private_key] = account
+        return account
 
     def load_config(self):
         config = {
-            "rpc": "https://rpc.testnet.citrea.xyz",
+            "rpcs": [url.strip() for url in os.getenv("RPC_URLS", "https://rpc.testnet.citrea.xyz").split(",") if url.strip()],
+            "hedge_reads": True,
+            "rpc_batch_window": RPC_BATCH_WINDOW,
             "chain_id": 5115,
             "explorer": "https://explorer.testnet.citrea.xyz",
+            "confirmations": 1,
+            "receipt_timeout": 180,
+            "stuck_blocks": STUCK_AFTER_BLOCKS,
+            "block_poll_interval": 1.0,
+            "metrics_port": int(os.getenv("METRICS_PORT", "0")),
         }
         return config
 
     def initialize_provider(self):
+        # The provider is created here but only connects in `connect`, since the
+        # aiohttp session has to be opened inside the running event loop.
+        provider = RPCPoolProvider(self.config["rpcs"], hedge=self.config["hedge_reads"], batch_window=self.config["rpc_batch_window"], metrics=self.metrics)
+        return AsyncWeb3(provider)
+
+    async def open_connection(self):
+        started = time.monotonic()
+        await asyncio.gather(asyncio.to_thread(load_web3), self.unlock_keystores())
+        self.setup_chain()
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        )
+        self.w3.provider.use_session(self.session)
         try:
-            w3 = Web3(Web3.HTTPProvider(self.config["rpc"]))
-            if not w3.is_connected():
-                raise Exception("Failed to connect to RPC")
-            log.success(f"Connected to {self.config['rpc']}")
-            return w3
+            healthy = await self.w3.provider.probe()
+            if not healthy:
+                raise Exception("Failed to connect to any RPC endpoint")
+        except Exception:
+            # A retry builds a new session, so this one must not be left open behind it
+            await self.session.close()
+            raise
+        log.success(f"Connected to {len(healthy)}/{len(self.config['rpcs'])} RPC endpoint(s) in {(time.monotonic() - started) * 1000:.0f} ms, sends pinned to {self.w3.provider.pinned.url}")
+        self.journal.start()
+        self.resume_pending()
+        if self.config["metrics_port"]:
+            await self.metrics.serve(self.config["metrics_port"])
+
+    async def connect(self):
+        try:
+            await self.open_connection()
         except Exception as e:
             log.error(f"Provider initialization failed: {str(e)}")
+            await self.close()
             sys.exit(1)
 
+    def start_connecting(self):
+        # Connect in the background while the menu is up; actions wait for it in `ensure_connected`
+        if self.connecting is None or (self.connecting.done() and self.connecting.exception()):
+            self.connecting = asyncio.create_task(self.open_connection())
+            # Nobody may await a failed attempt (the menu can exit first), so its error is read here
+            self.connecting.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+    async def ensure_connected(self):
+        self.start_connecting()
+        try:
+            await asyncio.shield(self.connecting)
+            return True
+        except Exception as e:
+            log.error(f"Provider initialization failed: {str(e)}")
+            return False
+
+    async def close(self):
+        if self.connecting and not self.connecting.done():
+            self.connecting.cancel()
+            await asyncio.gather(self.connecting, return_exceptions=True)
+        if self.w3 is not None:
+            await self.engine.stop()
+            for task in self.resumed:
+                task.cancel()
+            await asyncio.gather(*self.resumed, return_exceptions=True)
+            await self.receipts.stop()
+            self.gas_profiles.save()
+            self.allowances.save()
+        await self.journal.stop()
+        if self.index is not None:
+            self.index.close()
+        await self.metrics.stop()
+        await log.flush()
+        if log.json_path != "-":
+            self.metrics.summary()
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    def resume_pending(self):
+        # Transactions a previous session sent but never saw mined are watched again, never re-sent
+        accounts = {self.get_account(key).address.lower(): self.get_account(key) for key in self.private_keys}
+        for tx_hash, entry in list(self.journal.pending.items()):
+            account = accounts.get(entry["account"].lower())
+            if account is None:
+                continue
+            log.info(f"Resuming receipt wait for {tx_hash} (nonce {entry['nonce']})")
+            self.resumed.append(asyncio.create_task(self.resume_receipt(account, Web3.to_bytes(hexstr=tx_hash))))
+
+    async def resume_receipt(self, account, tx_hash):
+        try:
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            log.info(f"Resumed transaction {self.w3.to_hex(receipt['transactionHash'])} mined with status {receipt['status']}")
+        except TimeExhausted:
+            log.warn(f"Resumed transaction {self.w3.to_hex(tx_hash)} was not mined within the receipt timeout")
+        except Exception as e:
+            log.error(f"Error resuming transaction {self.w3.to_hex(tx_hash)}: {e}")
+
+    async def prompt(self, text):
+        # Read user input on a worker thread so pending work keeps running on the loop
+        await log.flush()
+        return await asyncio.to_thread(input, text)
+
     def get_private_keys(self):
-        key = os.getenv("PRIVATE_KEY_1")
-        if not key:
+        # Every PRIVATE_KEY_<n> in the environment, ordered by n; keystore wallets follow them once unlocked
+        numbered = []
+        for name, value in os.environ.items():
+            if name.startswith("PRIVATE_KEY_") and name[len("PRIVATE_KEY_"):].isdigit() and value.strip():
+                numbered.append((int(name[len("PRIVATE_KEY_"):]), value.strip()))
+        if not numbered and not self.keystore_paths:
             log.error("No private key found in environment variables.")
             sys.exit(1)
-        return [key]
+        keys = [value for _, value in sorted(numbered)]
+        if self.keystore_paths:
+            log.info(f"Loaded {len(keys)} wallet(s), {len(self.keystore_paths)} more to unlock from {os.getenv('KEYSTORE_DIR')}")
+        else:
+            log.info(f"Loaded {len(keys)} wallet(s)")
+        return keys
+
+    def find_keystores(self):
+        # Standard encrypted keystore files in KEYSTORE_DIR: geth's UTC--... names or any *.json
+        directory = os.getenv("KEYSTORE_DIR")
+        if not directory:
+            return []
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            log.error(f"Cannot read keystore directory {directory}: {e}")
+            sys.exit(1)
+        return [os.path.join(directory, name) for name in names if name.startswith("UTC--") or name.endswith(".json")]
+
+    def wallet_count(self):
+        return len(self.private_keys) + len(self.keystore_paths)
+
+    async def ask_keystore_password(self):
+        # Asked only by paths that connect, so local-only commands never wait on a prompt
+        if not self.keystore_paths or self.keystore_password:
+            return
+        await log.flush()
+        try:
+            self.keystore_password = await asyncio.to_thread(getpass.getpass, f"Password for {len(self.keystore_paths)} keystore(s): ")
+        except EOFError:
+            raise Exception("No keystore password: set KEYSTORE_PASSWORD or run from a terminal")
+
+    async def unlock_keystores(self):
+        # Each keystore costs up to a second of key derivation, so they are decrypted in parallel worker
+        # processes while web3 loads. The keys are kept in memory only and never written anywhere.
+        if not self.keystore_paths:
+            return
+        await self.ask_keystore_password()
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        workers = min(len(self.keystore_paths), os.cpu_count() or 1)
+        # "spawn" because forking a process that already runs threads can deadlock the child
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = await asyncio.gather(*[
+                loop.run_in_executor(pool, decrypt_keystore, path, self.keystore_password) for path in self.keystore_paths
+            ], return_exceptions=True)
+        for path, result in zip(self.keystore_paths, results):
+            if isinstance(result, Exception):
+                # Most likely a wrong password; dropping it makes the next attempt prompt again
+                self.keystore_password = None
+                raise Exception(f"Could not decrypt keystore {path}: {result}")
+        self.private_keys.extend(results)
+        log.info(f"Unlocked {len(results)} keystore wallet(s) in {(time.monotonic() - started) * 1000:.0f} ms using {workers} process(es)")
+        self.keystore_paths, self.keystore_password = [], None
 
     def load_user_settings(self):
-        user_settings = {"transaction_count": 0}
+        user_settings = {
+            "transaction_count": 0, "fee_policy": "normal", "approval_policy": "multiple", "approval_multiple": 20,
+            "max_concurrency": 8, "swap_delay_range": [5, 15], "swap_mode": "single",
+            "simulate": True, "slippage_bps": 50
+        }
         try:
             if os.path.exists(CONFIG_FILE):
                 with open(CONFIG_FILE, 'r') as f:
@@ -165,96 +2474,350 @@ class SatsumaBot:
         return user_settings
 
     def save_user_settings(self):
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(self.settings, f, indent=2)
+        save_json_file(CONFIG_FILE, self.settings, "user settings")
 
     def generate_random_amount(self):
-        min_amount = 0.0001
-        max_amount = 0.0002
+        min_amount, max_amount = SWAP_AMOUNT_RANGE
         random_amount = random.uniform(min_amount, max_amount)
         return round(random_amount, 6)
 
+    def pick_swap_amount(self, route):
+        # Prices QUOTE_CANDIDATES random sizes against the cached pool state in one pass and picks
+        # among those the pools absorb within QUOTE_MAX_IMPACT_BPS; without quotes any candidate will do
+        candidates = [self.generate_random_amount() for _ in range(QUOTE_CANDIDATES)]
+        metadata = self.token_metadata.get(route[0])
+        if metadata is None:
+            return candidates[0]
+        quotes = self.pools.quote_route(route, [int(amount * 10 ** metadata["decimals"]) for amount in candidates])
+        usable = [amount for amount, quoted in zip(candidates, quotes) if quoted]
+        return random.choice(usable) if usable else candidates[0]
+
     async def get_token_balance(self, token_address, account_address):
-        if token_address == self.token_addresses["cBTC"]:
-            balance = self.w3.eth.get_balance(account_address)
-            return {"balance": balance, "decimals": 18, "symbol": "cBTC", "formatted": self.w3.from_wei(balance, 'ether')}
-        try:
-            token_contract = self.w3.eth.contract(address=token_address, abi=ERC20_ABI)
-            balance = token_contract.functions.balanceOf(account_address).call()
-            decimals = token_contract.functions.decimals().call()
-            symbol = token_contract.functions.symbol().call()
-            return {"balance": balance, "decimals": decimals, "symbol": symbol, "formatted": balance / (10 ** decimals)}
+        balances = await self.get_token_balances([token_address], account_address)
+        return balances[0]
+
+    async def get_token_balances(self, token_addresses, account_address):
+        # One aggregate3 round trip for every balance, plus decimals/symbol of tokens not seen before
+        calls = []
+        for token_address in token_addresses:
+            if token_address == self.token_addresses["cBTC"]:
+                calls.append(self.reader.native_balance(account_address))
+            else:
+                calls.append(ReadCall(token_address, "balanceOf(address)", [account_address], ["uint256"]))
+        unknown = [t for t in dict.fromkeys(token_addresses) if t not in self.token_metadata]
+        for token_address in unknown:
+            calls.append(ReadCall(token_address, "decimals()", [], ["uint8"]))
+            calls.append(ReadCall(token_address, "symbol()", [], ["string"]))
+        try:
+            results = await self.reader.read(calls)
         except Exception as e:
             log.error(f"Error getting token balance: {e}")
-            return None
+            return [None] * len(token_addresses)
+        metadata_results = results[len(token_addresses):]
+        for i, token_address in enumerate(unknown):
+            decimals, symbol = metadata_results[2 * i], metadata_results[2 * i + 1]
+            if decimals is not None and symbol is not None:
+                self.token_metadata[token_address] = {"decimals": decimals, "symbol": symbol}
+        balances = []
+        for token_address, balance in zip(token_addresses, results):
+            metadata = self.token_metadata.get(token_address)
+            if balance is None or metadata is None:
+                log.error(f"Error getting token balance: call to {token_address} failed")
+                balances.append(None)
+                continue
+            balances.append({"balance": balance, "decimals": metadata["decimals"], "symbol": metadata["symbol"], "formatted": balance / (10 ** metadata["decimals"])})
+        return balances
+
+    async def get_allowance(self, token_address, owner_address, spender_address, use_index=True):
+        if use_index:
+            indexed = self.allowances.get(owner_address, token_address, spender_address)
+            if indexed is not None:
+                return indexed
+        results = await self.reader.read([ReadCall(token_address, "allowance(address,address)", [owner_address, spender_address], ["uint256"])])
+        if results[0] is not None:
+            self.allowances.set(owner_address, token_address, spender_address, results[0])
+        return results[0]
+
+    def approval_amount(self, amount):
+        policy = self.settings["approval_policy"]
+        if policy not in APPROVAL_POLICIES:
+            raise ValueError(f"Unknown approval policy: {policy}")
+        if policy == "max":
+            return MAX_UINT256
+        if policy == "multiple":
+            return min(amount * int(self.settings["approval_multiple"]), MAX_UINT256)
+        return amount
+
+    async def with_gas_limit(self, tx, gas_key, default_gas, can_estimate=True):
+        tx["gas"] = await self.gas_profiles.gas_limit(tx, gas_key, default_gas, can_estimate)
+        return tx
+
+    async def send_transaction(self, account, tx, gas_key=None, progress=None):
+        # Allocates a local nonce, signs and broadcasts. Returns the tx hash without waiting for inclusion.
+        # `progress` is an automated run's {"index", "recorded"} marker; the swap counts as done once
+        # broadcast, so a resumed run waits for it instead of sending another.
+        tx = dict(tx, chainId=self.config["chain_id"])
+        intent = os.urandom(8).hex()
+        data = tx.get("data", b"")
+        self.journal.record("intent", id=intent, account=account.address, to=tx["to"], selector=data[:10] if isinstance(data, str) else Web3.to_hex(data)[:10])
+        for attempt in range(NONCE_RETRIES):
+            nonce = await self.nonces.allocate(account.address)
+            tx["nonce"] = nonce
+            with self.metrics.span("sign"):
+                signed_tx = self.w3.eth.account.sign_transaction(tx, private_key=account.key)
+            tx_hash = self.w3.to_hex(signed_tx.hash)
+            log.bind(account=account.address, nonce=nonce, tx_hash=tx_hash)
+            self.journal.record("signed", id=intent, hash=tx_hash, account=account.address, nonce=nonce)
+            self.receipts.track(signed_tx.hash)
+            if gas_key:
+                self.gas_keys[signed_tx.hash] = gas_key
+            try:
+                with self.metrics.span("broadcast"):
+                    await self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            except Exception as e:
+                message = str(e).lower()
+                if "already known" not in message:
+                    self.journal.record("rejected", hash=tx_hash, error=str(e))
+                    self.gas_keys.pop(signed_tx.hash, None)
+                    self.receipts.untrack(signed_tx.hash)
+                    if "nonce too low" in message or "nonce too high" in message:
+                        log.warn(f"Nonce {nonce} rejected for {account.address}, resyncing")
+                        await self.nonces.resync(account.address)
+                        continue
+                    self.nonces.release(account.address, nonce)
+                    raise
+            self.journal.record("broadcast", hash=tx_hash)
+            self.record_progress(progress)
+            self.bumper.register(account, tx, signed_tx.hash, await self.broadcast_head())
+            return signed_tx.hash
+        raise Exception(f"Could not obtain a valid nonce for {account.address}")
+
+    async def broadcast_head(self):
+        # Stuck detection counts from here. Nothing after a successful broadcast may fail the send,
+        # so a failed read falls back to the watcher's head, or to the first head the waiter sees.
+        try:
+            return await self.w3.eth.block_number
+        except Exception as e:
+            log.warn(f"Could not read the block number after broadcasting: {e}")
+            return self.receipts.head
+
+    def record_progress(self, progress):
+        if progress and not progress["recorded"]:
+            self.journal.record("progress", index=progress["index"])
+            progress["recorded"] = True
+
+    async def wait_for_receipt(self, account, tx_hash):
+        # The receipt may belong to a fee-bump replacement of `tx_hash`; callers report its hash
+        try:
+            with self.metrics.span("confirm"):
+                receipt = await self.bumper.wait(tx_hash)
+            self.journal.record("mined", hash=self.w3.to_hex(receipt["transactionHash"]), block=receipt["blockNumber"], status=receipt["status"])
+            gas_key = self.gas_keys.pop(tx_hash, None)
+            if gas_key and receipt["status"] == 1:
+                self.gas_profiles.record(gas_key, receipt["gasUsed"])
+            return receipt
+        except TimeExhausted:
+            # A transaction the node no longer knows about was dropped, so its nonce is free again
+            latest = self.bumper.latest(tx_hash)
+            try:
+                await self.w3.eth.get_transaction(latest)
+            except TransactionNotFound:
+                log.warn(f"Transaction {self.w3.to_hex(latest)} was dropped, resyncing nonce")
+                self.journal.record("dropped", hash=self.w3.to_hex(latest))
+                self.bumper.forget(tx_hash)
+                await self.nonces.resync(account.address)
+            raise
 
-    async def approve_token(self, account, token_address, spender_address, amount, nonce):
+    async def approve_token(self, account, token_address, spender_address, amount, allowance=None):
+        # Broadcasts the approval but does not wait for it; the caller pipelines its next
+        # transaction on the following nonce and confirms both afterwards.
         if token_address == self.token_addresses["cBTC"]:
-            return {"success": True, "nonce": nonce}
+            return {"success": True, "tx_hash": None}
         try:
-            token_contract = self.w3.eth.contract(address=token_address, abi=ERC20_ABI)
-            allowance = token_contract.functions.allowance(account.address, spender_address).call()
+            if allowance is None:
+                allowance = await self.get_allowance(token_address, account.address, spender_address)
+            if allowance is None:
+                raise Exception(f"Could not read allowance for {token_address}")
+            if 0 < allowance < amount * ALLOWANCE_RECHECK_MULTIPLE:
+                # Close to what is needed, the index may be off in either direction; the chain decides
+                allowance = await self.get_allowance(token_address, account.address, spender_address, use_index=False)
+                if allowance is None:
+                    raise Exception(f"Could not read allowance for {token_address}")
             if allowance >= amount:
                 log.success("Sufficient allowance exists.")
-                return {"success": True, "nonce": nonce}
-            approve_tx = token_contract.functions.approve(spender_address, amount).build_transaction({
-                "from": account.address, "gas": 150000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce
-            })
-            signed_tx = self.w3.eth.account.sign_transaction(approve_tx, private_key=account.key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
-            log.processing("Waiting for approval confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
-            if receipt["status"] == 1:
-                log.success(f"Approval successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "nonce": nonce + 1}
-            else:
-                log.error("Approval transaction failed.")
-                return {"success": False, "nonce": nonce}
+                return {"success": True, "tx_hash": None}
+            approve_amount = self.approval_amount(amount)
+            with self.metrics.span("approve"):
+                approve_tx = {
+                    "from": account.address, "to": token_address, **await self.fee_oracle.fees(),
+                    "data": APPROVE_CALLDATA.encode(spender_address, approve_amount)
+                }
+                gas_key = GasProfiles.key_for(token_address, approve_tx["data"], spender_address)
+                await self.with_gas_limit(approve_tx, gas_key, GAS_FALLBACKS["approve"])
+                tx_hash = await self.send_transaction(account, approve_tx, gas_key)
+            log.processing(f"Approval sent: {self.w3.to_hex(tx_hash)}")
+            return {"success": True, "tx_hash": tx_hash, "token": token_address, "spender": spender_address, "amount": approve_amount}
         except Exception as e:
             log.error(f"Approval error: {e}")
-            return {"success": False, "nonce": nonce}
+            return {"success": False, "tx_hash": None}
 
-    async def perform_swap(self, private_key, token_in, token_out, amount_in_float):
+    async def confirm_approvals(self, account, approvals):
+        for approval in approvals:
+            if not approval["tx_hash"] or approval.get("confirmed"):
+                continue
+            receipt = await self.wait_for_receipt(account, approval["tx_hash"])
+            approval["tx_hash"] = receipt["transactionHash"]
+            if receipt["status"] != 1:
+                log.error("Approval transaction failed.")
+                self.allowances.forget(account.address, approval["token"], approval["spender"])
+                return False
+            if not self.allowances.apply_receipt(receipt):
+                self.allowances.set(account.address, approval["token"], approval["spender"], approval["amount"])
+            approval["confirmed"] = True
+            log.success(f"Approval successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(approval['tx_hash'])}")
+        return True
+
+    def debit_allowances(self, account, spends):
+        # Debited at broadcast, so a spend whose receipt is never seen (a timeout, a restart) can only
+        # leave the index below the chain, never above it
+        for token_address, spender_address, amount in spends:
+            if token_address != self.token_addresses["cBTC"]:
+                self.allowances.spend(account.address, token_address, spender_address, amount)
+
+    def forget_allowances(self, account, spends):
+        # A revert (simulated or mined) may mean the index was wrong, so those entries are dropped
+        # and the next action reads the allowance from the chain
+        for token_address, spender_address, _ in spends:
+            if token_address != self.token_addresses["cBTC"]:
+                self.allowances.forget(account.address, token_address, spender_address)
+
+    async def preapprove(self, private_keys, token_addresses, spender_address, amount_float):
+        # Approve every (account, token) pair up front so steady-state swaps need a single transaction
+        if self.settings["approval_policy"] == "exact":
+            return
+        token_addresses = [t for t in token_addresses if t != self.token_addresses["cBTC"]]
+        log.processing(f"Pre-approving {len(token_addresses)} tokens for {len(private_keys)} accounts...")
+
+        async def preapprove_account(private_key):
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
+            balances = await self.get_token_balances(token_addresses, account.address)
+            approvals = []
+            for token_address, info in zip(token_addresses, balances):
+                if not info:
+                    continue
+                amount = int(amount_float * (10 ** info["decimals"]))
+                approvals.append(await self.approve_token(account, token_address, spender_address, amount))
+            return await self.confirm_approvals(account, approvals)
+
+        results = await asyncio.gather(*[preapprove_account(key) for key in private_keys], return_exceptions=True)
+        failed = sum(1 for result in results if result is not True)
+        if failed:
+            log.warn(f"Pre-approval failed for {failed} accounts; their swaps will approve on demand")
+        else:
+            log.success("Pre-approval complete")
+
+    def revert_reason(self, error):
+        data = getattr(error, "data", None)
+        if isinstance(data, str) and data.startswith(REVERT_ERROR_SELECTOR):
+            return self.w3.codec.decode(["string"], bytes.fromhex(data[10:]))[0]
+        if isinstance(data, str) and data.startswith(REVERT_PANIC_SELECTOR):
+            return f"panic 0x{self.w3.codec.decode(['uint256'], bytes.fromhex(data[10:]))[0]:02x}"
+        if isinstance(data, str) and len(data) >= 10:
+            return f"custom error {data[:10]}"
+        return getattr(error, "message", None) or str(error)
+
+    async def simulate(self, tx):
+        # eth_call the exact transaction; returns (True, return data) or (False, decoded revert reason)
+        call = {k: tx[k] for k in ("from", "to", "data", "value") if k in tx}
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            with self.metrics.span("simulate"):
+                return True, bytes(await self.w3.eth.call(call))
+        except ContractLogicError as e:
+            return False, self.revert_reason(e)
+
+    async def simulate_gate(self, tx, gas_key, default_gas):
+        # Runs before signing. The simulation and the gas sizing go out together, so they share a batch.
+        # Callers confirm fresh approvals first, since a simulation only sees mined state.
+        (ok, result), _ = await asyncio.gather(self.simulate(tx), self.with_gas_limit(tx, gas_key, default_gas))
+        if not ok:
+            log.error(f"Simulation reverted, not sending: {result}")
+        return ok, result
+
+    def with_slippage(self, amount):
+        return amount * (10000 - int(self.settings["slippage_bps"])) // 10000
+
+    async def preflight(self, account, *reads):
+        # Fees, the nonce sync and the action's own reads go out together so they share one JSON-RPC batch
+        with self.metrics.span("preflight"):
+            results = await asyncio.gather(self.fee_oracle.fees(), self.nonces.sync(account.address), *reads)
+        return results[0], results[2:]
+
+    async def perform_swap(self, private_key, token_in, token_out, amount_in_float, progress=None):
+        try:
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Performing swap from {token_in} to {token_out} for {amount_in_float}")
             
-            token_in_info = await self.get_token_balance(token_in, account.address)
+            router_address = self.contract_addresses["swap_router"]
+            allowance = None
+            if token_in != self.token_addresses["cBTC"]:
+                fees, (token_in_info, allowance, _) = await self.preflight(
+                    account,
+                    self.get_token_balance(token_in, account.address),
+                    self.get_allowance(token_in, account.address, router_address),
+                    self.pools.update()
+                )
+            else:
+                fees, (token_in_info, _) = await self.preflight(account, self.get_token_balance(token_in, account.address), self.pools.update())
             if not token_in_info: return {"success": False, "error": "Could not get token info"}
             
             amount_in_wei = int(amount_in_float * (10 ** token_in_info['decimals']))
-            nonce = self.w3.eth.get_transaction_count(account.address)
+            # With a local quote the minimum is known before anything is sent. A simulation runs without
+            # one, since the quote only covers the current tick range and may overstate the output.
+            (quoted,) = self.pools.quote(token_in, token_out, [amount_in_wei])
+            amount_out_min = self.with_slippage(quoted) if quoted and not self.settings["simulate"] else 0
+            spends = [(token_in, router_address, amount_in_wei)]
 
-            if token_in != self.token_addresses["cBTC"]:
-                approval_result = await self.approve_token(account, token_in, self.contracts["swap_router"].address, amount_in_wei, nonce)
-                if not approval_result["success"]: return {"success": False, "error": "Approval failed"}
-                nonce = approval_result["nonce"]
+            approval_result = await self.approve_token(account, token_in, router_address, amount_in_wei, allowance)
+            if not approval_result["success"]: return {"success": False, "error": "Approval failed"}
             
             deadline = int(time.time()) + 300
-            swap_params = {
-                "tokenIn": token_in,
-                "tokenOut": token_out,
-                "deployer": Web3.to_checksum_address("0x0000000000000000000000000000000000000000"),
-                "recipient": account.address,
-                "deadline": deadline,
-                "amountIn": amount_in_wei,
-                "amountOutMinimum": 0,
-                "limitSqrtPrice": 0
-            }
+            # tokenIn, tokenOut, recipient, deadline, amountIn, amountOutMinimum
+            swap_data = EXACT_INPUT_SINGLE_CALLDATA.encode(token_in, token_out, account.address, deadline, amount_in_wei, amount_out_min)
 
             value_wei = amount_in_wei if token_in == self.token_addresses["cBTC"] else 0
-            swap_tx = self.contracts["swap_router"].functions.exactInputSingle(swap_params).build_transaction({
-                "from": account.address, "gas": 500000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce, "value": value_wei
-            })
+            swap_tx = {
+                "from": account.address, "to": router_address, **fees, "value": value_wei,
+                "data": swap_data
+            }
+            gas_key = GasProfiles.key_for(router_address, swap_tx["data"], token_in, token_out)
+            if self.settings["simulate"]:
+                if not await self.confirm_approvals(account, [approval_result]):
+                    return {"success": False, "error": "Approval failed"}
+                ok, result = await self.simulate_gate(swap_tx, gas_key, GAS_FALLBACKS["default"])
+                if not ok:
+                    self.forget_allowances(account, spends)
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+                simulated = self.w3.codec.decode(["uint256"], result)[0]
+                amount_out_min = self.with_slippage(min(quoted, simulated) if quoted else simulated)
+                swap_tx["data"] = EXACT_INPUT_SINGLE_CALLDATA.encode(token_in, token_out, account.address, deadline, amount_in_wei, amount_out_min)
+            else:
+                await self.with_gas_limit(swap_tx, gas_key, GAS_FALLBACKS["default"], can_estimate=not approval_result["tx_hash"])
             
-            signed_tx = self.w3.eth.account.sign_transaction(swap_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, swap_tx, gas_key, progress)
+            self.debit_allowances(account, spends)
+            if not await self.confirm_approvals(account, [approval_result]):
+                return {"success": False, "error": "Approval failed"}
             log.processing("Waiting for swap confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
+            if receipt["status"] != 1:
+                self.forget_allowances(account, spends)
             if receipt["status"] == 1:
-                log.success(f"Swap successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"Swap successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("Swap transaction failed. Check explorer for details.")
                 return {"success": False, "error": "Transaction failed"}
@@ -262,48 +2825,186 @@ class SatsumaBot:
             log.error(f"Swap error: {e}")
             return {"success": False, "error": str(e)}
 
+    def encode_router_multicall(self, calls):
+        return ROUTER_MULTICALL_SELECTOR + self.w3.codec.encode(["bytes[]"], [calls])
+
+    async def simulate_router_multicall(self, account, calls, value_wei):
+        # Runs the bundle as an eth_call from the account; returns (True, per-call result bytes) or (False, reason)
+        ok, result = await self.simulate({
+            "from": account.address, "to": self.contract_addresses["swap_router"], "value": value_wei,
+            "data": self.encode_router_multicall(calls)
+        })
+        return (True, self.w3.codec.decode(["bytes[]"], result)[0]) if ok else (False, result)
+
+    async def perform_swap_route(self, private_key, route, amount_in_float, progress=None):
+        # Swaps along `route` (e.g. [USDC, WCBTC, SUMA]) in a single router multicall transaction.
+        # Native cBTC at either end is wrapped via msg.value or unwrapped to the account at the end.
+        try:
+            if len(route) < 2:
+                raise ValueError("A route needs at least two tokens")
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
+            log.step(f"Performing bundled swap along {' -> '.join(route)} for {amount_in_float}")
+
+            router_address = self.contract_addresses["swap_router"]
+            native = self.token_addresses["cBTC"]
+            native_in, native_out = route[0] == native, route[-1] == native
+            path = [self.token_addresses["WCBTC"] if token == native else token for token in route]
+            spent_tokens = [token for token in route[:-1] if token != native]
+            fees, (token_in_info, *allowances) = await self.preflight(
+                account,
+                self.get_token_balance(route[0], account.address),
+                *[self.get_allowance(token, account.address, router_address) for token in spent_tokens]
+            )
+            if not token_in_info: return {"success": False, "error": "Could not get token info"}
+            allowances = dict(zip(spent_tokens, allowances))
+
+            amount_in_wei = int(amount_in_float * (10 ** token_in_info['decimals']))
+            value_wei = amount_in_wei if native_in else 0
+            deadline = int(time.time()) + 300
+
+            def leg(i, amount, amount_out_min=0):
+                recipient = router_address if native_out and i == len(path) - 2 else account.address
+                return EXACT_INPUT_SINGLE_CALLDATA.encode(path[i], path[i + 1], recipient, deadline, amount, amount_out_min)
+
+            # Each leg's input is the simulated output of the previous one. A simulation can only
+            # spend allowances that are already mined, so approvals are confirmed before moving on.
+            amounts, spends = [amount_in_wei], []
+            for i in range(len(path) - 1):
+                token = route[i]
+                if token != native:
+                    approval = await self.approve_token(account, token, router_address, amounts[i], allowances.get(token))
+                    if not approval["success"] or not await self.confirm_approvals(account, [approval]):
+                        return {"success": False, "error": f"Approval failed for {token}"}
+                    spends.append((token, router_address, amounts[i]))
+                if i < len(path) - 2:
+                    ok, results = await self.simulate_router_multicall(account, [leg(j, amounts[j]) for j in range(i + 1)], value_wei)
+                    if not ok:
+                        log.error(f"Simulation of leg {i + 1} reverted, not sending: {results}")
+                        self.forget_allowances(account, spends)
+                        return {"success": False, "error": f"Simulation reverted: {results}", "reverted": True}
+                    amount_out = self.w3.codec.decode(["uint256"], results[i])[0]
+                    amounts.append(amount_out * (10000 - ROUTE_LEG_BUFFER_BPS) // 10000)
+
+            def bundle(minimums):
+                calls = [leg(i, amounts[i], minimums[i]) for i in range(len(path) - 1)]
+                if native_out:
+                    calls.append(UNWRAP_NATIVE_CALLDATA.encode(minimums[-1], account.address))
+                if native_in:
+                    calls.append(REFUND_NATIVE_CALLDATA.encode())
+                return calls
+
+            # The whole bundle is simulated once more; every leg then gets a minimum output from it
+            ok, results = await self.simulate_router_multicall(account, bundle([0] * (len(path) - 1)), value_wei)
+            if not ok:
+                log.error(f"Simulation reverted, not sending: {results}")
+                self.forget_allowances(account, spends)
+                return {"success": False, "error": f"Simulation reverted: {results}", "reverted": True}
+            leg_outputs = [self.w3.codec.decode(["uint256"], data)[0] for data in results[:len(path) - 1]]
+            for i, amount_out in enumerate(leg_outputs):
+                log.info(f"Leg {i + 1}: {amounts[i]} {path[i]} -> {amount_out} {path[i + 1]}")
+            calls = bundle([self.with_slippage(amount_out) for amount_out in leg_outputs])
+
+            bundle_tx = {
+                "from": account.address, "to": router_address, **fees, "value": value_wei,
+                "data": self.encode_router_multicall(calls)
+            }
+            gas_key = GasProfiles.key_for(router_address, bundle_tx["data"], *route)
+            await self.with_gas_limit(bundle_tx, gas_key, GAS_FALLBACKS["default"] * (len(path) - 1))
+
+            tx_hash = await self.send_transaction(account, bundle_tx, gas_key, progress)
+            self.debit_allowances(account, spends)
+            log.processing("Waiting for bundled swap confirmation...")
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
+
+            if receipt["status"] != 1:
+                self.forget_allowances(account, spends)
+            if receipt["status"] == 1:
+                log.success(f"Bundled swap successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash), "leg_outputs": leg_outputs}
+            else:
+                log.error("Bundled swap transaction failed. Check explorer for details.")
+                return {"success": False, "error": "Transaction failed"}
+        except Exception as e:
+            log.error(f"Bundled swap error: {e}")
+            return {"success": False, "error": str(e)}
+
     async def add_liquidity(self, private_key, token_a, token_b, amount_a, amount_b):
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Adding liquidity for {account.address} with {amount_a} {token_a} and {amount_b} {token_b}")
             
-            token_a_info = await self.get_token_balance(token_a, account.address)
-            token_b_info = await self.get_token_balance(token_b, account.address)
+            router_address = self.contract_addresses["liquidity_router"]
+            fees, ((token_a_info, token_b_info), allowance_a, allowance_b) = await self.preflight(
+                account,
+                self.get_token_balances([token_a, token_b], account.address),
+                self.get_allowance(token_a, account.address, router_address),
+                self.get_allowance(token_b, account.address, router_address)
+            )
             
             if not token_a_info or not token_b_info:
                 return {"success": False, "error": "Could not get token info"}
             
             amount_a_wei = int(amount_a * (10**token_a_info['decimals']))
             amount_b_wei = int(amount_b * (10**token_b_info['decimals']))
-            
-            nonce = self.w3.eth.get_transaction_count(account.address)
 
-            approval_a = await self.approve_token(account, token_a, self.contracts["liquidity_router"].address, amount_a_wei, nonce)
+            spends = [(token_a, router_address, amount_a_wei), (token_b, router_address, amount_b_wei)]
+            approval_a = await self.approve_token(account, token_a, router_address, amount_a_wei, allowance_a)
             if not approval_a["success"]: return {"success": False, "error": "Token A approval failed"}
-            nonce = approval_a['nonce']
 
-            approval_b = await self.approve_token(account, token_b, self.contracts["liquidity_router"].address, amount_b_wei, nonce)
+            approval_b = await self.approve_token(account, token_b, router_address, amount_b_wei, allowance_b)
             if not approval_b["success"]: return {"success": False, "error": "Token B approval failed"}
-            nonce = approval_b['nonce']
             
             deadline = int(time.time()) + 300
             
-            liquidity_tx = self.contracts["liquidity_router"].functions.addLiquidity(
-                token_a, token_b, account.address, amount_a_wei, amount_b_wei,
-                0, 0, deadline
-            ).build_transaction({
-                "from": account.address,
-                "gas": 500000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce
-            })
+            liquidity_tx = {
+                "from": account.address, "to": router_address,
+                **fees,
+                "data": ADD_LIQUIDITY_CALLDATA.encode(
+                    token_a, token_b, account.address, amount_a_wei, amount_b_wei,
+                    0, 0, deadline
+                )
+            }
+            gas_key = GasProfiles.key_for(router_address, liquidity_tx["data"], token_a, token_b)
+            if self.settings["simulate"]:
+                if not await self.confirm_approvals(account, [approval_a, approval_b]):
+                    return {"success": False, "error": "Approval failed"}
+                ok, result = await self.simulate_gate(liquidity_tx, gas_key, GAS_FALLBACKS["default"])
+                if not ok:
+                    self.forget_allowances(account, spends)
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+                # Only a router that returns the amounts it deposits gives minimums to bound; otherwise
+                # they stay unset, since the pool ratio decides how much of each desired amount is used
+                if len(result) >= 64:
+                    used_a, used_b = self.w3.codec.decode(["uint256", "uint256"], result[:64])
+                    liquidity_tx["data"] = ADD_LIQUIDITY_CALLDATA.encode(
+                        token_a, token_b, account.address, amount_a_wei, amount_b_wei,
+                        self.with_slippage(used_a), self.with_slippage(used_b), deadline
+                    )
+                    ok, result = await self.simulate(liquidity_tx)
+                    if not ok:
+                        log.error(f"Simulation reverted, not sending: {result}")
+                        self.forget_allowances(account, spends)
+                        return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+            else:
+                approvals_pending = approval_a["tx_hash"] or approval_b["tx_hash"]
+                await self.with_gas_limit(liquidity_tx, gas_key, GAS_FALLBACKS["default"], can_estimate=not approvals_pending)
             
-            signed_tx = self.w3.eth.account.sign_transaction(liquidity_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, liquidity_tx, gas_key)
+            self.debit_allowances(account, spends)
+            if not await self.confirm_approvals(account, [approval_a, approval_b]):
+                return {"success": False, "error": "Approval failed"}
             log.processing("Waiting for liquidity confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
+            if receipt["status"] != 1:
+                self.forget_allowances(account, spends)
             if receipt["status"] == 1:
-                log.success(f"Liquidity added successfully! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"Liquidity added successfully! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("Liquidity transaction failed.")
                 return {"success": False, "error": "Transaction failed"}
@@ -313,37 +3014,51 @@ class SatsumaBot:
 
     async def convert_to_vesuma(self, private_key, amount, lock_time_days):
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Converting {amount} SUMA to veSUMA with lock time of {lock_time_days} days.")
             
             amount_wei = int(amount * 10**18)
             unlock_time = int(time.time()) + (lock_time_days * 24 * 60 * 60)
-            nonce = self.w3.eth.get_transaction_count(account.address)
             
-            approve_result = await self.approve_token(account, self.token_addresses["SUMA"], self.token_addresses["veSUMA"], amount_wei, nonce)
+            spends = [(self.token_addresses["SUMA"], self.token_addresses["veSUMA"], amount_wei)]
+            approve_result = await self.approve_token(account, self.token_addresses["SUMA"], self.token_addresses["veSUMA"], amount_wei)
             if not approve_result["success"]:
                 log.error("SUMA approval failed")
                 return {"success": False, "error": "Approval transaction failed"}
             
-            nonce = approve_result["nonce"]
-            
-            selector = "0x12e82674"  # `create_lock` selector
-            encoded_params = self.w3.abi.encode(['uint256', 'uint256'], [amount_wei, unlock_time])
-            tx_data = selector + self.w3.to_hex(encoded_params)[2:]
+            tx_data = CREATE_LOCK_CALLDATA.encode(amount_wei, unlock_time)
             
             create_lock_tx = {
                 "from": account.address, "to": self.token_addresses["veSUMA"],
-                "gas": 500000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce, "data": tx_data
+                **await self.fee_oracle.fees(), "data": tx_data
             }
+            gas_key = GasProfiles.key_for(self.token_addresses["veSUMA"], tx_data)
+            if self.settings["simulate"]:
+                if not await self.confirm_approvals(account, [approve_result]):
+                    log.error("SUMA approval failed")
+                    return {"success": False, "error": "Approval transaction failed"}
+                ok, result = await self.simulate_gate(create_lock_tx, gas_key, GAS_FALLBACKS["default"])
+                if not ok:
+                    self.forget_allowances(account, spends)
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+            else:
+                await self.with_gas_limit(create_lock_tx, gas_key, GAS_FALLBACKS["default"], can_estimate=not approve_result["tx_hash"])
             
-            signed_tx = self.w3.eth.account.sign_transaction(create_lock_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, create_lock_tx, gas_key)
+            self.debit_allowances(account, spends)
+            if not await self.confirm_approvals(account, [approve_result]):
+                log.error("SUMA approval failed")
+                return {"success": False, "error": "Approval transaction failed"}
             log.processing("Waiting for veSUMA conversion confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
+            if receipt["status"] != 1:
+                self.forget_allowances(account, spends)
             if receipt["status"] == 1:
-                log.success(f"veSUMA conversion successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"veSUMA conversion successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("veSUMA conversion failed: Transaction reverted.")
                 return {"success": False, "error": "Transaction failed"}
@@ -353,38 +3068,47 @@ class SatsumaBot:
 
     async def convert_vesuma_to_suma(self, private_key):
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Attempting to convert veSUMA to SUMA for {account.address}")
             
-            try:
-                locked_info = self.contracts["vesuma"].functions.locked(account.address).call()
-                end_time = locked_info[1]
-                current_time = int(time.time())
-                
-                if current_time < end_time:
-                    lock_end_dt = datetime.fromtimestamp(end_time)
-                    log.error(f"Lock period has not expired. Lock ends at {lock_end_dt}. Cannot withdraw veSUMA.")
-                    return {"success": False, "error": "Lock period has not expired"}
-            except Exception as e:
-                log.warn(f"Could not check lock status: {e}. Attempting transaction anyway.")
+            # Without a readable lock there is nothing to learn from sending `exit` except a revert
+            locked_call = ReadCall(self.contract_addresses["vesuma"], "locked(address)", [account.address], ["uint256", "uint256"])
+            locked_info = (await self.reader.read([locked_call]))[0]
+            if locked_info is None:
+                log.error("Could not check lock status, not sending exit.")
+                return {"success": False, "error": "Could not check lock status"}
+            end_time = locked_info[1]
+            current_time = int(time.time())
+            
+            if current_time < end_time:
+                lock_end_dt = datetime.fromtimestamp(end_time)
+                log.error(f"Lock period has not expired. Lock ends at {lock_end_dt}. Cannot withdraw veSUMA.")
+                return {"success": False, "error": "Lock period has not expired"}
             
             selector = "0x7f8661a1"  # `exit` selector
             tx_data = selector
-            nonce = self.w3.eth.get_transaction_count(account.address)
             
             exit_tx = {
                 "from": account.address, "to": self.token_addresses["veSUMA"],
-                "gas": 500000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce, "data": tx_data
+                **await self.fee_oracle.fees(), "data": tx_data
             }
+            gas_key = GasProfiles.key_for(self.token_addresses["veSUMA"], tx_data)
+            if self.settings["simulate"]:
+                ok, result = await self.simulate_gate(exit_tx, gas_key, GAS_FALLBACKS["default"])
+                if not ok:
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+            else:
+                await self.with_gas_limit(exit_tx, gas_key, GAS_FALLBACKS["default"])
             
-            signed_tx = self.w3.eth.account.sign_transaction(exit_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, exit_tx, gas_key)
             log.processing("Waiting for veSUMA -> SUMA conversion confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
             if receipt["status"] == 1:
-                log.success(f"veSUMA -> SUMA conversion successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"veSUMA -> SUMA conversion successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("veSUMA -> SUMA conversion failed.")
                 return {"success": False, "error": "Transaction failed"}
@@ -394,31 +3118,50 @@ class SatsumaBot:
 
     async def stake_vesuma(self, private_key, amount):
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Staking {amount} veSUMA for {account.address}")
             
             amount_wei = int(amount * 10**18)
-            nonce = self.w3.eth.get_transaction_count(account.address)
+            staking_address = self.contract_addresses["staking"]
             
-            approve_result = await self.approve_token(account, self.token_addresses["veSUMA"], self.contracts["staking"].address, amount_wei, nonce)
+            spends = [(self.token_addresses["veSUMA"], staking_address, amount_wei)]
+            approve_result = await self.approve_token(account, self.token_addresses["veSUMA"], staking_address, amount_wei)
             if not approve_result["success"]:
                 log.error("veSUMA approval failed")
                 return {"success": False, "error": "Approval transaction failed"}
-            nonce = approve_result["nonce"]
 
-            stake_tx = self.contracts["staking"].functions.stake(amount_wei).build_transaction({
-                "from": account.address,
-                "gas": 500000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce
-            })
+            stake_tx = {
+                "from": account.address, "to": staking_address,
+                **await self.fee_oracle.fees(),
+                "data": STAKE_CALLDATA.encode(amount_wei)
+            }
+            gas_key = GasProfiles.key_for(staking_address, stake_tx["data"])
+            if self.settings["simulate"]:
+                if not await self.confirm_approvals(account, [approve_result]):
+                    log.error("veSUMA approval failed")
+                    return {"success": False, "error": "Approval transaction failed"}
+                ok, result = await self.simulate_gate(stake_tx, gas_key, GAS_FALLBACKS["default"])
+                if not ok:
+                    self.forget_allowances(account, spends)
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+            else:
+                await self.with_gas_limit(stake_tx, gas_key, GAS_FALLBACKS["default"], can_estimate=not approve_result["tx_hash"])
             
-            signed_tx = self.w3.eth.account.sign_transaction(stake_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, stake_tx, gas_key)
+            self.debit_allowances(account, spends)
+            if not await self.confirm_approvals(account, [approve_result]):
+                log.error("veSUMA approval failed")
+                return {"success": False, "error": "Approval transaction failed"}
             log.processing("Waiting for staking confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
+            if receipt["status"] != 1:
+                self.forget_allowances(account, spends)
             if receipt["status"] == 1:
-                log.success(f"veSUMA staking successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"veSUMA staking successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("Staking transaction failed")
                 return {"success": False, "error": "Transaction failed"}
@@ -428,24 +3171,31 @@ class SatsumaBot:
 
     async def vote_with_vesuma(self, private_key, gauge_address, weight):
         try:
-            account = self.w3.eth.account.from_key(private_key)
+            account = self.get_account(private_key)
+            log.bind(account=account.address)
             log.step(f"Voting with veSUMA for {account.address}")
             
-            nonce = self.w3.eth.get_transaction_count(account.address)
-            
-            vote_tx = self.contracts["voting"].functions.vote(gauge_address, weight).build_transaction({
-                "from": account.address,
-                "gas": 200000, "gasPrice": self.w3.eth.gas_price, "nonce": nonce
-            })
+            vote_tx = {
+                "from": account.address, "to": self.contract_addresses["voting"],
+                **await self.fee_oracle.fees(),
+                "data": VOTE_CALLDATA.encode(gauge_address, weight)
+            }
+            gas_key = GasProfiles.key_for(self.contract_addresses["voting"], vote_tx["data"])
+            if self.settings["simulate"]:
+                ok, result = await self.simulate_gate(vote_tx, gas_key, GAS_FALLBACKS["vote"])
+                if not ok:
+                    return {"success": False, "error": f"Simulation reverted: {result}", "reverted": True}
+            else:
+                await self.with_gas_limit(vote_tx, gas_key, GAS_FALLBACKS["vote"])
             
-            signed_tx = self.w3.eth.account.sign_transaction(vote_tx, private_key=private_key)
-            tx_hash = self.w3.eth.send_raw_transaction(signed_tx.raw_transaction)
+            tx_hash = await self.send_transaction(account, vote_tx, gas_key)
             log.processing("Waiting for voting confirmation...")
-            receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+            receipt = await self.wait_for_receipt(account, tx_hash)
+            tx_hash = receipt["transactionHash"]
             
             if receipt["status"] == 1:
-                log.success(f"Voting successful! Tx: {self.config['explorer']}/tx/{tx_hash.hex()}")
-                return {"success": True, "tx_hash": tx_hash.hex()}
+                log.success(f"Voting successful! Tx: {self.config['explorer']}/tx/{self.w3.to_hex(tx_hash)}")
+                return {"success": True, "tx_hash": self.w3.to_hex(tx_hash)}
             else:
                 log.error("Voting transaction failed")
                 return {"success": False, "error": "Transaction failed"}
@@ -469,14 +3219,15 @@ class SatsumaBot:
         
     async def show_balances(self):
         try:
-            account = self.w3.eth.account.from_key(self.private_keys[0])
+            account = self.get_account(self.private_keys[0])
             log.info(f"Showing balances for {account.address}")
+            await log.flush()
             
             print(f"\n{Colors.CYAN}=== Account Balances ==={Colors.RESET}")
             print(f"{Colors.WHITE}Address: {account.address}{Colors.RESET}")
             
-            for symbol, address in self.token_addresses.items():
-                balance_info = await self.get_token_balance(address, account.address)
+            balances = await self.get_token_balances(list(self.token_addresses.values()), account.address)
+            for symbol, balance_info in zip(self.token_addresses, balances):
                 if balance_info:
                     print(f"{Colors.GREEN}{symbol} Balance: {balance_info['formatted']:.6f} {balance_info['symbol']}{Colors.RESET}")
                 else:
@@ -487,49 +3238,133 @@ class SatsumaBot:
         except Exception as e:
             log.error(f"Error showing balances: {str(e)}")
 
+    def open_index(self):
+        if self.index is None:
+            self.index = EventIndexer()
+        return self.index
+
+    def token_label(self, address):
+        for symbol, token_address in self.token_addresses.items():
+            if token_address.lower() == address.lower():
+                return symbol
+        return address[:10]
+
+    async def index_history(self):
+        # Brings the local event index up to the latest confirmed block for every wallet
+        started = time.monotonic()
+        index = self.open_index()
+        accounts = [self.get_account(key).address for key in self.private_keys]
+        tokens = [address for symbol, address in self.token_addresses.items() if symbol != "cBTC"]
+        await self.get_token_balances(tokens, accounts[0])  # also fills in every token's decimals
+        decimals = {address.lower(): self.token_metadata[address]["decimals"] for address in tokens if address in self.token_metadata}
+        head = max(0, await self.w3.eth.block_number - self.config["confirmations"])
+        log.processing(f"Indexing events for {len(accounts)} wallet(s) up to block {head}...")
+        added = await index.sync(self.w3, accounts, tokens, decimals, head)
+        log.success(f"Indexed {added} new event(s) in {(time.monotonic() - started):.1f}s, index is at block {index.checkpoint()}")
+
+    def show_history(self, limit):
+        index = self.open_index()
+        started = time.monotonic()
+        history = index.history(limit)
+        print(f"\n{Colors.CYAN}=== Transaction History (index at block {index.checkpoint()}) ==={Colors.RESET}")
+        for tx_hash, account, block, action, rows in history:
+            moves = " ".join(f"{row[6]:+.6f} {self.token_label(row[3])}" for row in rows if row[4] != "approval" and row[6])
+            print(f"{Colors.WHITE}{block:>10} {account[:10]} {action:<14}{Colors.RESET} {moves} {Colors.CYAN}{tx_hash}{Colors.RESET}")
+        if not history:
+            print(f"{Colors.YELLOW}Nothing indexed yet, run with --index-history first{Colors.RESET}")
+        print(f"{Colors.CYAN}{'='*35} {(time.monotonic() - started) * 1000:.1f} ms{Colors.RESET}")
+
+    def show_pnl(self):
+        index = self.open_index()
+        started = time.monotonic()
+        print(f"\n{Colors.CYAN}=== Net Token Flows (index at block {index.checkpoint()}) ==={Colors.RESET}")
+        print(f"{Colors.WHITE}{'wallet':<12}{'token':<12}{'in':>16}{'out':>16}{'net':>16}{'txs':>6}{Colors.RESET}")
+        for account, contract, received, spent, net, txs in index.net_flows():
+            color = Colors.GREEN if net >= 0 else Colors.RED
+            print(f"{account[:10]:<12}{self.token_label(contract):<12}{received:>16.6f}{spent:>16.6f}{color}{net:>+16.6f}{Colors.RESET}{txs:>6}")
+        print(f"{Colors.CYAN}{'='*35} {(time.monotonic() - started) * 1000:.1f} ms{Colors.RESET}")
+
     async def start_automated_swaps(self):
-        if self.settings["transaction_count"] == 0:
-            log.error("No transactions configured. Please set transaction count first.")
-            return
-        
-        log.info(f"Starting automated swaps with {self.settings['transaction_count']} transactions")
+        # A run the journal shows as unfinished picks up where it stopped instead of starting over
+        run = self.journal.run
+        if run and run["done"] < run["total"]:
+            total, done = run["total"], run["done"]
+            log.info(f"Resuming interrupted run: {total - done} of {total} transactions remaining")
+        else:
+            if self.settings["transaction_count"] == 0:
+                log.error("No transactions configured. Please set transaction count first.")
+                return
+            total, done = self.settings["transaction_count"], 0
+            self.journal.record("run", total=total, done=0)
+            log.info(f"Starting automated swaps with {total} transactions")
         
         token_list = [self.token_addresses["USDC"], self.token_addresses["WCBTC"], self.token_addresses["SUMA"]]
+        await self.preapprove(self.private_keys, token_list, self.contract_addresses["swap_router"], SWAP_AMOUNT_RANGE[1])
         
-        for i in range(self.settings["transaction_count"]):
+        min_delay, max_delay = self.settings["swap_delay_range"]
+
+        async def run_swap(i, private_key, route, final=False):
+            log.info(f"Transaction {i+1}/{total}")
+            result = None
+            progress = {"index": i, "recorded": False}
             try:
-                token_in = random.choice(token_list)
-                token_out = random.choice([t for t in token_list if t != token_in])
-                amount = self.generate_random_amount()
-                private_key = random.choice(self.private_keys)
-                
-                log.info(f"Transaction {i+1}/{self.settings['transaction_count']}")
-                
-                result = await self.perform_swap(private_key, token_in, token_out, amount)
-                
-                if result["success"]:
-                    log.success(f"Swap {i+1} completed successfully")
+                await self.pools.update()
+                amount = self.pick_swap_amount(route)
+                if len(route) > 2:
+                    result = await self.perform_swap_route(private_key, route, amount, progress)
                 else:
-                    log.error(f"Swap {i+1} failed: {result.get('error', 'Unknown error')}")
-                
-                delay = random.uniform(5, 15)
-                log.info(f"Waiting {delay:.1f} seconds before next transaction...")
-                await asyncio.sleep(delay)
-                
-            except Exception as e:
-                log.error(f"Error in transaction {i+1}: {str(e)}")
-                continue
+                    result = await self.perform_swap(private_key, route[0], route[1], amount, progress)
+            finally:
+                # A swap whose simulation reverted gets another try below, so it does not count yet;
+                # one interrupted before its broadcast is sent again when the run resumes
+                if result is not None and (final or not result.get("reverted")):
+                    self.record_progress(progress)
+            if result["success"]:
+                log.success(f"Swap {i+1} completed successfully")
+            else:
+                log.error(f"Swap {i+1} failed: {result.get('error', 'Unknown error')}")
+            return result
+
+        # Spread the swaps round-robin over the accounts; each account runs its own swaps in order.
+        # In "route" mode every swap is a two-leg route bundled into one router multicall.
+        futures, jobs = [], []
+        route_length = 3 if self.settings["swap_mode"] == "route" else 2
+        for i in range(done, total):
+            route = random.sample(token_list, route_length)
+            private_key = self.private_keys[i % len(self.private_keys)]
+            job = lambda final=False, i=i, private_key=private_key, route=route: run_swap(i, private_key, route, final)
+            jobs.append((private_key, job))
+            futures.append(self.engine.submit(private_key, job, delay=random.uniform(min_delay, max_delay)))
+
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        # Swaps stopped by the simulation gate never reached the chain; each is rescheduled once
+        retry = [n for n, result in enumerate(results) if isinstance(result, dict) and result.get("reverted")]
+        if retry:
+            log.info(f"Rescheduling {len(retry)} swap(s) whose simulation reverted in {SIMULATION_RETRY_DELAY}s")
+            await asyncio.sleep(SIMULATION_RETRY_DELAY)
+            retried = [self.engine.submit(jobs[n][0], lambda job=jobs[n][1]: job(final=True)) for n in retry]
+            for n, result in zip(retry, await asyncio.gather(*retried, return_exceptions=True)):
+                results[n] = result
+        self.journal.record("run_end")
+        for i, result in enumerate(results, start=done):
+            if isinstance(result, Exception):
+                log.error(f"Error in transaction {i+1}: {str(result)}")
+        succeeded = sum(1 for result in results if isinstance(result, dict) and result["success"])
+        log.info(f"{succeeded}/{len(results)} swaps succeeded across {min(len(results), len(self.private_keys))} account(s)")
         
         log.success("Automated swaps completed!")
 
     async def handle_menu_option(self, option):
         try:
+            if option in NETWORK_OPTIONS and not await self.ensure_connected():
+                return True
+
             if option == "1":
                 await self.start_automated_swaps()
             
             elif option == "2":
                 try:
-                    count = int(input("Enter transaction count: "))
+                    count = int(await self.prompt("Enter transaction count: "))
                     if count > 0:
                         self.settings["transaction_count"] = count
                         self.save_user_settings()
@@ -541,14 +3376,17 @@ class SatsumaBot:
             
             elif option == "3":
                 print(f"\n{Colors.CYAN}=== Manual Swap ==={Colors.RESET}")
-                token_in_name = input("Enter token to swap from (e.g., SUMA, USDC): ").strip().upper()
-                token_out_name = input("Enter token to swap to: ").strip().upper()
+                token_in_name = (await self.prompt("Enter token to swap from (e.g., SUMA, USDC): ")).strip().upper()
+                token_out_names = (await self.prompt("Enter token to swap to (use > for a route, e.g. WCBTC>SUMA): ")).strip().upper().split(">")
                 try:
-                    amount = float(input("Enter amount: "))
-                    if amount > 0 and token_in_name in self.token_addresses and token_out_name in self.token_addresses:
-                        token_in = self.token_addresses[token_in_name]
-                        token_out = self.token_addresses[token_out_name]
-                        await self.perform_swap(self.private_keys[0], token_in, token_out, amount)
+                    amount = float(await self.prompt("Enter amount: "))
+                    route_names = [token_in_name] + [name.strip() for name in token_out_names]
+                    if amount > 0 and all(name in self.token_addresses for name in route_names):
+                        route = [self.token_addresses[name] for name in route_names]
+                        if len(route) > 2:
+                            await self.perform_swap_route(self.private_keys[0], route, amount)
+                        else:
+                            await self.perform_swap(self.private_keys[0], route[0], route[1], amount)
                     else:
                         log.error("Invalid token name or amount.")
                 except ValueError:
@@ -556,11 +3394,11 @@ class SatsumaBot:
             
             elif option == "4":
                 print(f"\n{Colors.CYAN}=== Add Liquidity ==={Colors.RESET}")
-                token_a_name = input("Enter token A (e.g., USDC, WCBTC): ").strip().upper()
-                token_b_name = input("Enter token B: ").strip().upper()
+                token_a_name = (await self.prompt("Enter token A (e.g., USDC, WCBTC): ")).strip().upper()
+                token_b_name = (await self.prompt("Enter token B: ")).strip().upper()
                 try:
-                    amount_a = float(input(f"Enter amount for {token_a_name}: "))
-                    amount_b = float(input(f"Enter amount for {token_b_name}: "))
+                    amount_a = float(await self.prompt(f"Enter amount for {token_a_name}: "))
+                    amount_b = float(await self.prompt(f"Enter amount for {token_b_name}: "))
                     
                     if token_a_name in self.token_addresses and token_b_name in self.token_addresses and amount_a > 0 and amount_b > 0:
                         token_a = self.token_addresses[token_a_name]
@@ -574,8 +3412,8 @@ class SatsumaBot:
             elif option == "5":
                 print(f"\n{Colors.CYAN}=== Convert SUMA to veSUMA ==={Colors.RESET}")
                 try:
-                    amount = float(input("Enter SUMA amount: "))
-                    lock_days = int(input("Enter lock time (days): "))
+                    amount = float(await self.prompt("Enter SUMA amount: "))
+                    lock_days = int(await self.prompt("Enter lock time (days): "))
                     if amount > 0 and lock_days > 0:
                         await self.convert_to_vesuma(self.private_keys[0], amount, lock_days)
                     else:
@@ -589,7 +3427,7 @@ class SatsumaBot:
             elif option == "7":
                 print(f"\n{Colors.CYAN}=== Stake veSUMA ==={Colors.RESET}")
                 try:
-                    amount = float(input("Enter veSUMA amount to stake: "))
+                    amount = float(await self.prompt("Enter veSUMA amount to stake: "))
                     if amount > 0:
                         await self.stake_vesuma(self.private_keys[0], amount)
                     else:
@@ -600,8 +3438,8 @@ class SatsumaBot:
             elif option == "8":
                 print(f"\n{Colors.CYAN}=== Vote with veSUMA ==={Colors.RESET}")
                 try:
-                    gauge_address = input("Enter gauge address: ").strip()
-                    weight = int(input("Enter vote weight (0-100): "))
+                    gauge_address = (await self.prompt("Enter gauge address: ")).strip()
+                    weight = int(await self.prompt("Enter vote weight (0-100): "))
                     if 0 <= weight <= 100:
                         await self.vote_with_vesuma(self.private_keys[0], Web3.to_checksum_address(gauge_address), weight)
                     else:
@@ -625,17 +3463,28 @@ class SatsumaBot:
         return True
 
     async def run(self):
+        # The password prompt comes before the menu, since both read the terminal
+        try:
+            await self.ask_keystore_password()
+        except Exception as e:
+            log.error(str(e))
+        self.start_connecting()
         log.success("Satsuma DeFi Bot initialized successfully!")
+        startup = time.monotonic() - STARTED_AT
+        if startup > STARTUP_BUDGET:
+            log.warn(f"Startup took {startup * 1000:.0f} ms, over the {STARTUP_BUDGET * 1000:.0f} ms budget")
         
         while True:
             try:
+                await log.flush()
                 self.display_menu()
-                choice = input(f"{Colors.WHITE}[➤] Select option (1-10): {Colors.RESET}").strip()
+                choice = (await self.prompt(f"{Colors.WHITE}[➤] Select option (1-10): {Colors.RESET}")).strip()
                 
                 if not choice:
                     continue
                 
-                should_continue = await self.handle_menu_option(choice)
+                with log.scope():
+                    should_continue = await self.handle_menu_option(choice)
                 if not should_continue:
                     break
                 
@@ -646,9 +3495,102 @@ class SatsumaBot:
                 log.error(f"Unexpected error: {str(e)}")
                 continue
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Satsuma DeFi Bot")
+    parser.add_argument("--transaction-count", type=int, help="Save the automated swap transaction count and exit")
+    parser.add_argument("--show-settings", action="store_true", help="Print the saved settings and exit")
+    parser.add_argument("--log-json", default=os.getenv("LOG_JSON"), help="Also append every log record as a JSON line to this file; \"-\" writes JSON lines to stdout instead")
+    parser.add_argument("--index-history", action="store_true", help="Index our wallets' on-chain events into the local history database and exit")
+    parser.add_argument("--history", type=int, metavar="N", help="Print the latest N indexed transactions and exit, without touching the network")
+    parser.add_argument("--pnl", action="store_true", help="Print net token flows per wallet from the local index and exit")
+    parser.add_argument("--plan", help="Run the steps of a JSON (or YAML) plan file without prompts and exit")
+    parser.add_argument("--plan-result", default=PLAN_RESULT_FILE, help=f"Where --plan writes its JSON report (default {PLAN_RESULT_FILE})")
+    parser.add_argument("--daemon", action="store_true", help="Stay connected and take jobs over a local control API until stopped")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, help=f"Unix socket the --daemon API listens on (default {DAEMON_SOCKET})")
+    parser.add_argument("--daemon-port", type=int, help=f"Serve the --daemon API on http://{METRICS_HOST}:PORT instead of the Unix socket")
+    return parser.parse_args()
+
+async def run_plan(bot, path, result_path):
+    # Exit status: 0 when every step succeeded, 1 when any failed or was skipped, 2 for a bad plan
+    try:
+        runner = PlanRunner(bot, PlanRunner.load(path))
+    except (OSError, ValueError) as e:
+        log.error(f"Invalid plan {path}: {e}")
+        await bot.close()
+        sys.exit(2)
+    log.info(f"Running plan {path} with {len(runner.steps)} step(s)")
+    try:
+        if not await bot.ensure_connected():
+            sys.exit(1)
+        report = await runner.run()
+    finally:
+        await bot.close()
+    report["plan"] = path
+    if save_json_file(result_path, report, "plan result"):
+        log.info(f"Plan report written to {result_path}")
+    sys.exit(0 if report["failed"] == report["skipped"] == 0 else 1)
+
+async def run_daemon(bot, socket_path, port):
+    try:
+        if not await bot.ensure_connected():
+            sys.exit(1)
+        await Daemon(bot).run(socket_path, port)
+    finally:
+        await bot.close()
+
 async def main():
+    args = parse_args()
+    log.configure(json_path=args.log_json)
+    log.start()
+    try:
+        await dispatch(args)
+    finally:
+        await log.stop()
+
+async def dispatch(args):
     bot = SatsumaBot()
-    await bot.run()
+    # Settings-only commands never load web3 or touch the network
+    if args.transaction_count is not None or args.show_settings:
+        if args.transaction_count is not None:
+            if args.transaction_count <= 0:
+                log.error("Transaction count must be positive")
+                return
+            bot.settings["transaction_count"] = args.transaction_count
+            bot.save_user_settings()
+            log.success(f"Transaction count set to {args.transaction_count}")
+        if args.show_settings:
+            await log.flush()
+            print(json.dumps(bot.settings, indent=2))
+        await bot.close()
+        return
+    # History queries only read the local index
+    if args.history is not None or args.pnl:
+        await log.flush()
+        if args.history is not None:
+            bot.show_history(args.history)
+        if args.pnl:
+            bot.show_pnl()
+        await bot.close()
+        return
+    if args.plan:
+        await run_plan(bot, args.plan, args.plan_result)
+        return
+    if args.daemon:
+        await run_daemon(bot, args.socket, args.daemon_port)
+        return
+    if args.index_history:
+        try:
+            if await bot.ensure_connected():
+                await bot.index_history()
+        except Exception as e:
+            log.error(f"Indexing failed: {e}")
+        finally:
+            await bot.close()
+        return
+    try:
+        await bot.run()
+    finally:
+        await bot.close()
 
 if __name__ == "__main__":
     asyncio.run(main())